@@ -8,10 +8,278 @@ import random
 import string
 import subprocess
 import shutil
+import threading
+import xmlrpc.client
 try:
-    from .util import Util
+    from .util import Util, TaskGraph
 except ImportError:
-    from util import Util
+    from util import Util, TaskGraph
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    """XML-RPC transport whose connections give up after timeout seconds"""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        return conn
+
+class CobblerCLI():
+    """
+    Cobbler backend that runs the cobbler CLI in the cobbler container, one
+    `sudo docker exec` per call. Used when cobblerd's XML-RPC API can't be reached.
+
+    Items are named by kind ('distro', 'profile', 'system') and name, and fields use
+    the XML-RPC field names (autoinstall_meta, kernel_options, ...).
+    """
+    container = 'cobbler_container'
+    # dumps cobbler's stored items in one go, run by the container's python
+    _INVENTORY = (
+        'import glob, json, sys\n'
+        'json.dump({kind: [json.load(open(path)) for path in\n'
+        '                  sorted(glob.glob(f"/var/lib/cobbler/collections/{kind}s/*.json"))]\n'
+        '           for kind in ("distro", "profile", "system")}, sys.stdout)\n'
+    )
+
+    def _run(self, *args):
+        """Runs a cobbler command in the container and returns the finished process"""
+        return subprocess.run(['sudo', 'docker', 'exec', self.container, 'cobbler', *args],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    @staticmethod
+    def _flags(fields):
+        """Turns a dict of fields into CLI flags"""
+        flags = []
+        for field, value in fields.items():
+            if isinstance(value, bool):
+                value = str(value).lower()
+            flags.append(f'--{field.replace("_", "-")}={value}')
+        return flags
+
+    def exists(self, kind, name):
+        """Returns True if the item exists"""
+        proc = self._run(kind, 'report', f'--name={name}')
+        return proc.returncode == 0 and f'No {kind} found' not in proc.stdout.decode()
+
+    def report(self, kind, name):
+        """Returns a printable report of the item"""
+        return self._run(kind, 'report', f'--name={name}').stdout.decode()
+
+    def get(self, kind, name):
+        """Returns the stored fields of the item, or None if it doesn't exist"""
+        proc = subprocess.run(['sudo', 'docker', 'exec', self.container, 'cat',
+                               f'/var/lib/cobbler/collections/{kind}s/{name}.json'],
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        return json.loads(proc.stdout) if proc.returncode == 0 else None
+
+    def add(self, kind, name, fields):
+        """Adds an item with the given fields. Returns True if successful"""
+        return self._run(kind, 'add', f'--name={name}', *self._flags(fields)).returncode == 0
+
+    def edit(self, kind, name, fields, interface=None):
+        """
+        Edits fields of an item. interface is an optional (name, fields) pair for a
+        system's network interface. Returns True if successful
+        """
+        flags = self._flags(fields)
+        if interface:
+            flags += [f'--interface={interface[0]}', *self._flags(interface[1])]
+        return self._run(kind, 'edit', f'--name={name}', *flags).returncode == 0
+
+    def remove(self, kind, name, recursive=False):
+        """
+        Removes an item, and with recursive the items under it. Returns True if
+        successful
+        """
+        flags = ['--recursive'] if recursive else []
+        return self._run(kind, 'remove', f'--name={name}', *flags).returncode == 0
+
+    def ping(self):
+        """Returns True if cobblerd answers the CLI"""
+        return self._run('version').returncode == 0
+
+    def sync(self):
+        """Runs a full cobbler sync. Returns True if successful"""
+        return self._run('sync').returncode == 0
+
+    def sync_systems(self, names):
+        """Rewrites the boot files of some systems only. Returns True if successful"""
+        return self._run('sync', f'--systems={",".join(names)}').returncode == 0
+
+    def sync_dhcp(self):
+        """Rewrites and restarts the DHCP config only. Returns True if successful"""
+        return self._run('sync', '--dhcp').returncode == 0
+
+    def listing(self):
+        """Returns a printable list of all items"""
+        return self._run('list').stdout.decode()
+
+    def inventory(self):
+        """
+        Returns all distros, profiles and systems as
+        {'distro': {name: fields}, 'profile': {...}, 'system': {...}}, read straight from
+        cobbler's collections with one docker exec
+        """
+        proc = subprocess.run(['sudo', 'docker', 'exec', self.container,
+                               'python3', '-c', self._INVENTORY],
+                              stdout=subprocess.PIPE, check=True)
+        return {kind: {item['name']: item for item in items}
+                for kind, items in json.loads(proc.stdout).items()}
+
+class CobblerXMLRPC():
+    """
+    Cobbler backend that talks to cobblerd's XML-RPC API over one kept-alive HTTP
+    connection, logging in once and again only if the token expires. Same interface as
+    CobblerCLI.
+
+    ```python
+    api = CobblerXMLRPC('http://127.0.0.1:25151', 'cobbler', 'cobbler')
+    api.add('profile', 'rocky8', {'distro': 'rocky8-x86_64', 'autoinstall': 'rocky8.ks'})
+    ```
+    """
+
+    def __init__(self, url, user, password):
+        """
+        Args:
+          - url (str): URL of the cobbler API, e.g. http://127.0.0.1:25151
+          - user (str): Cobbler API user
+          - password (str): Password of user
+        Raises:
+          - OSError if cobblerd can't be reached
+          - xmlrpc.client.Fault if the login is refused
+        """
+        self.url = url
+        self.server = xmlrpc.client.ServerProxy(url, allow_none=True)
+        self._login = (user, password)
+        self._lock = threading.Lock()
+        self.token = self.server.login(user, password)
+
+    def _call(self, method, *args, token=True, trailing=()):
+        """
+        Calls an API method, with the login token after args if token is set, followed by
+        the trailing arguments. Logs in again and retries once if the token has expired.
+        """
+        with self._lock:
+            try:
+                return getattr(self.server, method)(*args, *([self.token] if token else []),
+                                                    *trailing)
+            except xmlrpc.client.Fault as exc:
+                if not token or 'token' not in exc.faultString.lower():
+                    raise
+                self.token = self.server.login(*self._login)
+                return getattr(self.server, method)(*args, self.token, *trailing)
+
+    def close(self):
+        """Closes the connection to cobblerd"""
+        self.server('close')()
+
+    @staticmethod
+    def probe(url, timeout=2.0):
+        """
+        Returns True if cobblerd answers at url, without logging in. Uses a new connection
+        with a timeout, so it works right after cobblerd restarts and never hangs
+        """
+        try:
+            return bool(xmlrpc.client.ServerProxy(
+                url, transport=_TimeoutTransport(timeout)).ping())
+        except (OSError, xmlrpc.client.Error):
+            return False
+
+    def ping(self):
+        """Returns True if cobblerd answers the API"""
+        return self.probe(self.url)
+
+    def exists(self, kind, name):
+        """Returns True if the item exists"""
+        return self._call('get_item', kind, name, token=False) not in ('~', {}, None)
+
+    def report(self, kind, name):
+        """Returns a printable report of the item"""
+        return json.dumps(self._call('get_item', kind, name, token=False), indent=2, default=str)
+
+    def get(self, kind, name):
+        """Returns the stored fields of the item, or None if it doesn't exist"""
+        item = self._call('get_item', kind, name, token=False)
+        return None if item in ('~', {}, None) else item
+
+    def _modify(self, kind, handle, fields):
+        """Sets fields on an item being edited"""
+        for field, value in fields.items():
+            self._call('modify_item', kind, handle, field, value)
+
+    def add(self, kind, name, fields):
+        """Adds an item with the given fields. Returns True if successful"""
+        handle = self._call('new_item', kind)
+        self._modify(kind, handle, dict({'name': name}, **fields))
+        return bool(self._call('save_item', kind, handle))
+
+    def edit(self, kind, name, fields, interface=None):
+        """
+        Edits fields of an item. interface is an optional (name, fields) pair for a
+        system's network interface. Returns True if successful
+        """
+        handle = self._call('get_item_handle', kind, name)
+        self._modify(kind, handle, fields)
+        if interface:
+            self._call('modify_item', kind, handle, 'modify_interface',
+                       {f'{field.replace("_", "")}-{interface[0]}': value
+                        for field, value in interface[1].items()})
+        return bool(self._call('save_item', kind, handle))
+
+    def remove(self, kind, name, recursive=False):
+        """
+        Removes an item, and with recursive the items under it. Returns True if
+        successful
+        """
+        return bool(self._call('remove_item', kind, name, trailing=(recursive,)))
+
+    def sync(self):
+        """Runs a full cobbler sync. Returns True if successful"""
+        return bool(self._call('sync'))
+
+    def sync_systems(self, names, timeout=600):
+        """
+        Rewrites the boot files of some systems only, through cobblerd's syncsystems
+        background task, and waits up to timeout seconds for the task to end. Returns True
+        if it completed
+        """
+        event = self._call('background_syncsystems', {'systems': list(names), 'verbose': False})
+        deadline = time.monotonic() + timeout
+        for wait in Util.backoff(base=0.1, cap=2):
+            state = self._call('get_task_status', event, token=False)[2]
+            if state != 'running':
+                return state == 'complete'
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def sync_dhcp(self):
+        """Rewrites and restarts the DHCP config only. Returns True if successful"""
+        return bool(self._call('sync_dhcp'))
+
+    def listing(self):
+        """Returns a printable list of all items"""
+        lines = []
+        for kind in ('distro', 'profile', 'system', 'repo', 'image', 'mgmtclass', 'package',
+                     'file', 'menu'):
+            try:
+                names = self._call('get_item_names', kind, token=False)
+            except xmlrpc.client.Fault:
+                continue
+            lines.append(f'{kind}s:')
+            lines.extend(f'   {name}' for name in names)
+        return '\n'.join(lines)
+
+    def inventory(self):
+        """
+        Returns all distros, profiles and systems as
+        {'distro': {name: fields}, 'profile': {...}, 'system': {...}}, one call per kind
+        """
+        return {kind: {item['name']: item for item in self._call(f'get_{kind}s', token=False)}
+                for kind in ('distro', 'profile', 'system')}
 
 class Cobbler():
     """
@@ -19,6 +287,7 @@ class Cobbler():
     - Distro imports
     - Profile naming
     - System creation
+    - Reconciling cobbler with the configured systems (Cobbler.reconcile)
 
     Include by doing
     ```python
@@ -29,6 +298,27 @@ class Cobbler():
     ...
     ```
     """
+    # how Cobbler.reconcile prints each kind of plan step
+    _SIGNS = {'create': '+', 'add': '+', 'edit': '~', 'remove': '-'}
+    # distro comment recording which ISO a distro was imported from
+    _ISO_COMMENT = 'aslinuxtester iso sha256:'
+    # sampled ISO hash, run on the host or in the container wherever the ISO is. Prints
+    # the mtime and size, and the hash only if they differ from the ones passed in
+    _ISO_DIGEST = (
+        'import hashlib, os, sys\n'
+        'path, mtime, size = sys.argv[1:4]\n'
+        'stat = os.stat(path)\n'
+        'print(stat.st_mtime_ns, stat.st_size)\n'
+        'if [str(stat.st_mtime_ns), str(stat.st_size)] != [mtime, size]:\n'
+        '    samples, chunk = 64, 1 << 20\n'
+        '    digest = hashlib.sha256(str(stat.st_size).encode())\n'
+        '    with open(path, "rb") as iso:\n'
+        '        for i in range(samples):\n'
+        '            iso.seek(max(stat.st_size - chunk, 0) * i // (samples - 1))\n'
+        '            digest.update(iso.read(chunk))\n'
+        '    print(digest.hexdigest())\n'
+    )
+
     def __init__(self, **kwargs):
         """
         If util is supplied at init, set the class-level util to that object.
@@ -39,15 +329,29 @@ class Cobbler():
           - repo_dir (str): [None] The path to the configuration repository
           - quiet (bool): [False] Shut it up you
           - debug (bool): [False] Enable debug prints
+          - backend (str): ['auto'] 'xmlrpc' to use cobblerd's XML-RPC API (CobblerXMLRPC),
+            'cli' to run the cobbler CLI in the container for every call (CobblerCLI), or
+            'auto' to use the API if it can be reached and the CLI otherwise
+          - api_url (str): ['http://127.0.0.1:25151'] URL of the cobbler API
+          - api_user (str): ['cobbler'] Cobbler API user
+          - api_password (str): ['cobbler'] Password of api_user
+          - ready_timeout (float): [60] Seconds to wait for cobblerd to answer after it
+            was synced or restarted, see Cobbler.wait_ready
         Raises:
           - ValueError if neither repo_dir nor util are provided
+          - OSError or xmlrpc.client.Fault if backend='xmlrpc' and the API login fails
         """
 
         opts = {
-            'util'      : None,
-            'repo_dir'  : None,
-            'quiet'     : False,
-            'debug'     : False
+            'util'          : None,
+            'repo_dir'      : None,
+            'quiet'         : False,
+            'debug'         : False,
+            'backend'       : 'auto',
+            'api_url'       : 'http://127.0.0.1:25151',
+            'api_user'      : 'cobbler',
+            'api_password'  : 'cobbler',
+            'ready_timeout' : 60
         }
         opts.update(kwargs)
 
@@ -58,6 +362,21 @@ class Cobbler():
         else:
             raise ValueError("repo_dir is required if util is not provided.")
 
+        self.ready_timeout = opts['ready_timeout']
+        self._iso_lock = threading.Lock()
+        if opts['backend'] == 'cli':
+            self.backend = CobblerCLI()
+        else:
+            try:
+                self.backend = CobblerXMLRPC(opts['api_url'], opts['api_user'],
+                                             opts['api_password'])
+            except (OSError, xmlrpc.client.Error) as exc:
+                if opts['backend'] == 'xmlrpc':
+                    raise
+                self.util.print(f'Cobbler API at {opts["api_url"]} unavailable ({exc}), '
+                                f'using the cobbler CLI', quiet=opts['quiet'])
+                self.backend = CobblerCLI()
+
     ################### FUNCTION DEFS #########################
     def subproc_print(self, p, **kwargs):
         """
@@ -89,6 +408,7 @@ class Cobbler():
           - reload (bool): [False] Reload OS and configuration from os.json
           - quiet (bool): [False] Suppress status messages
           - debug (bool): [False] Enable debug prints
+          - sync (str): ['auto'] See Cobbler.provision_systems
         Raises:
           - SystemError if cobbler failed to import the requested OS or the system could
             not be added
@@ -100,40 +420,365 @@ class Cobbler():
             'force'     : False,
             'reload'    : False,
             'quiet'     : False,
-            'debug'     : False
+            'debug'     : False,
+            'sync'      : 'auto'
         }
         opts.update(kwargs)
 
-        if not isinstance(config['os'], dict):
-            raise TypeError(("config['os'] must be a full dictionary defining the target,"
-                             "try running the name of the OS thru Util.get_os_config."))
-        if opts['reload']:
-            self.remove_system(config['system_name'], **opts)
-            if not self.remove_profile(config['os'], **opts):
-                raise SystemError(
-                    f"Could not delete cobbler profile named {config['os']['profile']}."
-                    )
-        if not self.create_profile_if_missing(config, **opts):
-            raise SystemError(
-                f"Could not find or create a cobbler profile named {config['os']['profile']}."
-                )
-
-        self.util.print(f"Provisioning {config['system_name']}...")
+        if not self.provision_systems([config], **opts)[config['system_name']]:
+            self.util.print(" Unable to add system to cobbler!", quiet=opts['quiet'])
+            raise SystemError('Cobbler failure!')
+        self.util.print(" Done!")
         sys.stdout.flush()
+        return True
+
+    def provision_systems(self, configs, **kwargs):
+        """
+        Registers many systems at once, e.g. a whole rack from config/systems, through
+        Cobbler.reconcile: missing profiles are created, new or changed systems are added
+        or edited, systems already matching their config are left alone, then cobbler is
+        synced once for the whole batch.
+
+        With sync='auto' the sync is a full one only if a profile was created or changed
+        by this call. Otherwise only the boot files of these systems and the DHCP config
+        are rewritten, which takes far less time than a full sync.
+
+        Args:
+          - configs (list): Formatted configuration dicts from util.Util.build_config
+        Keyword args:
+          - force (bool): [False] Delete and re-add the systems even if they are up to date
+          - reload (bool): [False] Reload OS and configuration from os.json. Distros are
+            kept and only imported again if their ISO changed
+          - prune (bool): [False] Remove systems that aren't in configs, see Cobbler.plan
+          - dry_run (bool): [False] Only print what would be changed
+          - quiet (bool): [False] Suppress status messages
+          - debug (bool): [False] Enable debug prints
+          - sync (str): ['auto'] 'auto', 'full' to always run a full sync, 'systems' to
+            only ever sync these systems and DHCP, or 'none' to leave syncing to the caller
+        Raises:
+          - SystemError if cobbler failed to import a requested OS
+          - TypeError if an invalid OS configuration is provided
+        Returns:
+            A dict of True or False by system name, see Cobbler.reconcile
+        """
+        opts = {
+            'force'     : False,
+            'reload'    : False,
+            'prune'     : False,
+            'dry_run'   : False,
+            'quiet'     : False,
+            'debug'     : False,
+            'sync'      : 'auto'
+        }
+        opts.update(kwargs)
+
+        profiles = {}
+        for config in configs:
+            if not isinstance(config['os'], dict):
+                raise TypeError(("config['os'] must be a full dictionary defining the target,"
+                                 "try running the name of the OS thru Util.get_os_config."))
+            profiles.setdefault(config['os']['profile'], config)
+
+        if (opts['force'] or opts['reload']) and not opts['dry_run']:
+            for config in configs:
+                self.remove_system(config['system_name'], **opts)
+        if opts['reload'] and not opts['dry_run']:
+            for config in profiles.values():
+                if not self.remove_profile(config['os'], **dict(opts, distro=False)):
+                    raise SystemError(
+                        f"Could not delete cobbler profile named {config['os']['profile']}."
+                        )
+
+        results = self.reconcile(configs, **opts)
+        if not opts['dry_run']:
+            self.util.print(self.backend.listing(), quiet=opts['quiet'])
+        return results
+
+    def sync(self, **kwargs):
+        """
+        Syncs cobbler's generated files. A full sync rewrites every TFTP/PXE file; with
+        systems set only those systems' boot files and the DHCP config are rewritten, and a
+        full sync is run instead if the server can't do that. Waits for cobblerd to answer
+        before and after (Cobbler.wait_ready).
+
+        Keyword args:
+          - systems (list): [None] Names of the systems to sync, or None for a full sync
+          - quiet (bool): [False] Suppress status messages
+        Raises:
+          - TimeoutError if cobblerd doesn't answer
+        Returns:
+            True if successful, else False
+        """
+        opts = {
+            'systems'   : None,
+            'quiet'     : False
+        }
+        opts.update(kwargs)
+
+        self.wait_ready(quiet=opts['quiet'])
+        done = False
+        if opts['systems']:
+            self.util.print(f'Syncing {len(opts["systems"])} systems and DHCP',
+                            quiet=opts['quiet'])
+            try:
+                done = self.backend.sync_systems(opts['systems']) and self.backend.sync_dhcp()
+            except xmlrpc.client.Fault as exc:
+                self.util.print(f'Targeted sync failed ({exc.faultString})', quiet=opts['quiet'])
+        if not done:
+            self.util.print('Running a full cobbler sync', quiet=opts['quiet'])
+            done = self.backend.sync()
+        self.wait_ready(quiet=opts['quiet'])
+        return done
+
+    def wait_ready(self, **kwargs):
+        """
+        Waits until cobblerd answers (see CobblerXMLRPC.ping and CobblerCLI.ping), polling
+        on an exponential backoff. Use after restarting or syncing cobblerd instead of
+        sleeping.
+
+        Keyword args:
+          - timeout (float): [Cobbler.ready_timeout] Seconds to give up after
+          - quiet (bool): [False] Suppress status messages
+        Raises:
+          - TimeoutError if cobblerd doesn't answer within timeout
+        """
+        opts = {
+            'timeout'   : self.ready_timeout,
+            'quiet'     : False
+        }
+        opts.update(kwargs)
+        self.util.wait_for(self.backend.ping, what='cobblerd', **opts)
+
+    def plan(self, configs, **kwargs):
+        """
+        Works out the smallest set of changes that brings cobbler to the state described by
+        configs, from one inventory snapshot rather than probing every item.
+
+        Each step is a dict with 'action' ('create', 'add', 'edit' or 'remove'), 'kind',
+        'name', and for 'add' and 'edit' the 'fields' to set and the system 'interface' as a
+        (netdev, fields) pair or None. 'create' steps are profiles to import through
+        Cobbler.create_profile_if_missing and carry the 'config' to do it with.
+
+        Args:
+          - configs (list): Formatted configuration dicts from util.Util.build_config
+        Keyword args:
+          - prune (bool): [False] Also remove systems that aren't in configs, and profiles
+            from os.json that no remaining system uses
+          - inventory (dict): [None] A snapshot from Cobbler.backend.inventory, taken if None
+        Returns:
+            The list of steps, in the order they need to run
+        """
+        opts = {
+            'prune'     : False,
+            'inventory' : None
+        }
+        opts.update(kwargs)
+        have = opts['inventory'] or self.backend.inventory()
+
+        steps = []
+        systems = {}
+        profiles = set()
+        for config in configs:
+            systems[config['system_name']] = self._system_fields(self._system_env(config))
+            osconfig = config['os']
+            if osconfig['profile'] in profiles:
+                continue
+            profiles.add(osconfig['profile'])
+            profile = have['profile'].get(osconfig['profile'])
+            if profile is None:
+                steps.append({'action': 'create', 'kind': 'profile',
+                              'name': osconfig['profile'], 'config': config})
+                continue
+            changed = self._changed(profile, {
+                'distro'        : f'{osconfig["distro"]}-x86_64',
+                'autoinstall'   : f'{osconfig["profile"]}.ks'
+            })
+            if changed:
+                steps.append({'action': 'edit', 'kind': 'profile', 'name': osconfig['profile'],
+                              'fields': changed, 'interface': None})
+
+        for name, (fields, interface) in systems.items():
+            system = have['system'].get(name)
+            if system is None:
+                steps.append({'action': 'add', 'kind': 'system', 'name': name,
+                              'fields': fields, 'interface': interface})
+                continue
+            changed = self._changed(system, fields)
+            current = system.get('interfaces', {}).get(interface[0], {})
+            if not self._changed(current, interface[1]):
+                interface = None
+            if changed or interface:
+                steps.append({'action': 'edit', 'kind': 'system', 'name': name,
+                              'fields': changed, 'interface': interface})
+
+        if opts['prune']:
+            for name in sorted(have['system']):
+                if name not in systems:
+                    steps.append({'action': 'remove', 'kind': 'system', 'name': name})
+            managed = [profile for os_type in self.util.get_os_config()['os'].values()
+                       for profile in os_type if profile != 'global']
+            for name in sorted(have['profile']):
+                if name in managed and name not in profiles:
+                    steps.append({'action': 'remove', 'kind': 'profile', 'name': name})
+        return steps
+
+    def reconcile(self, configs, **kwargs):
+        """
+        Brings cobbler to the state described by configs: prints the plan from
+        Cobbler.plan, then applies it and syncs once. Nothing is touched or synced if
+        cobbler is already up to date, so repeat runs cost one inventory read.
+
+        Args:
+          - configs (list): Formatted configuration dicts from util.Util.build_config
+        Keyword args:
+          - prune (bool): [False] See Cobbler.plan
+          - dry_run (bool): [False] Only print the plan
+          - quiet (bool): [False] Suppress status messages
+          - debug (bool): [False] Enable debug prints
+          - sync (str): ['auto'] See Cobbler.provision_systems
+        Raises:
+          - SystemError if a profile could not be created
+        Returns:
+            A dict of True or False by system name, for whether the system is in its
+            desired state. With dry_run, False means it would be changed
+        """
+        opts = {
+            'prune'     : False,
+            'dry_run'   : False,
+            'quiet'     : False,
+            'debug'     : False,
+            'sync'      : 'auto'
+        }
+        opts.update(kwargs)
+
+        steps = self.plan(configs, prune=opts['prune'])
+        counts = {action: sum(step['action'] == action for step in steps)
+                  for action in ('create', 'add', 'edit', 'remove')}
+        self.util.print(f'Cobbler plan: {counts["create"] + counts["add"]} to add, '
+                        f'{counts["edit"]} to change, {counts["remove"]} to remove',
+                        quiet=opts['quiet'])
+        for step in steps:
+            line = f'  {self._SIGNS[step["action"]]} {step["kind"]} {step["name"]}'
+            if step['action'] == 'edit':
+                changes = list(step['fields'])
+                if step['interface']:
+                    changes.append(f'interface {step["interface"][0]}')
+                line += f' ({", ".join(changes)})'
+            self.util.print(line, quiet=opts['quiet'])
+
+        results = {config['system_name']: True for config in configs}
+        if opts['dry_run']:
+            for step in steps:
+                if step['kind'] == 'system' and step['name'] in results:
+                    results[step['name']] = False
+            return results
+
+        nosync = dict(opts, sync=False)
+        full = opts['sync'] == 'full'
+        synced = []
+        creates = [step['config'] for step in steps if step['action'] == 'create']
+        if creates:
+            self.create_profiles(creates, **nosync)
+            full = full or opts['sync'] == 'auto'
+            # an import can replace a distro, so plan the rest against what is there now
+            steps = self.plan(configs, prune=opts['prune'])
+        for step in steps:
+            kind, name = step['kind'], step['name']
+            if step['action'] == 'create':
+                continue
+            if step['action'] == 'remove':
+                ok = self.backend.remove(kind, name)
+            elif step['action'] == 'add':
+                fields = dict(step['fields'])
+                ok = self.backend.add(kind, name, {'profile': fields.pop('profile')}) and \
+                    self.backend.edit(kind, name, fields, interface=step['interface'])
+            else:
+                ok = self.backend.edit(kind, name, step['fields'], interface=step['interface'])
+            if not ok:
+                self.util.print(f'Failed to {step["action"]} {kind} {name}', quiet=opts['quiet'])
+            if kind == 'system' and name in results:
+                results[name] = bool(ok)
+            if kind == 'system' and step['action'] != 'remove':
+                synced.append(name)
+            else:
+                full = full or opts['sync'] == 'auto'
+            if opts['debug'] and step['action'] != 'remove':
+                self.util.print(self.backend.report(kind, name))
+
+        if opts['sync'] != 'none' and (steps or creates):
+            self.sync(systems=None if full else synced, quiet=opts['quiet'])
+        return results
+
+    @staticmethod
+    def _options(value):
+        """Turns cobbler's 'key=value key' option strings into dicts, like cobbler does"""
+        if not isinstance(value, str):
+            return {key: None if val is None else str(val) for key, val in (value or {}).items()}
+        options = {}
+        for token in value.split():
+            key, _, val = token.partition('=')
+            options[key] = val if '=' in token else None
+        return options
+
+    @classmethod
+    def _changed(cls, current, desired):
+        """Returns the fields of desired that differ from the item current"""
+        changed = {}
+        for field, value in desired.items():
+            have = current.get(field)
+            if field in ('kernel_options', 'kernel_options_post', 'autoinstall_meta'):
+                same = cls._options(have) == cls._options(value)
+            elif field == 'mac_address':
+                same = str(have).lower() == str(value).lower()
+            else:
+                same = have == value
+            if not same:
+                changed[field] = value
+        return changed
+
+    @staticmethod
+    def _system_fields(env):
+        """
+        Returns the cobbler fields of a system and its (netdev, fields) interface from an
+        env dict as used by Cobbler.add_system_ported_from_script
+        """
+        return {
+            'profile'               : env['PROFILE'],
+            'gateway'               : env['GATEWAY'],
+            'netboot_enabled'       : True,
+            'hostname'              : env['SYSTEM_NAME'].replace('_', '-'),
+            'kernel_options'        : env['KOPTS'],
+            'kernel_options_post'   : env['KOPTS_POST'],
+            'filename'              : 'grub/grubx64.efi',
+            'autoinstall_meta'      : env['KSMETASTRING']
+        }, (env['NETDEV'], {
+            'mac_address'           : env['MAC_ADDRESS'],
+            'ip_address'            : env['IP_ADDRESS'],
+            'netmask'               : '255.255.255.0',
+            'static'                : True,
+            'dns_name'              : env['SYSTEM_NAME']
+        })
+
+    def _system_env(self, config):
+        """
+        Builds the env dict for Cobbler.add_system_ported_from_script from a config.
+        Fills in config['kopts'] and config['kopts_post'] on the way, as it always has,
+        without extending them again when the same config is planned twice.
+        """
         if 'ksmeta' in config:
             ks_meta = ' '.join(['{}={}'.format(ksm, config['ksmeta'][ksm]) for ksm in config['ksmeta']])
         else:
             ks_meta = ''
         kopts_def = f'inst.ks.device={config["netdev"]} console=tty0 console=ttyS0,115200,8,n,1'
-        if 'kopts' in config:
-            config['kopts'] = kopts_def + ' ' + config['kopts']
-            self.util.print("Kopts exteneded: " + config['kopts']) 
-        else:
+        if 'kopts' not in config:
             config['kopts'] = kopts_def
+        elif not config['kopts'].startswith(kopts_def):
+            config['kopts'] = kopts_def + ' ' + config['kopts']
+            self.util.print("Kopts exteneded: " + config['kopts'])
         config['kopts_post'] = config['kopts']
         if 'nfsroot' in config:
             config['kopts_post'] = f'{config["kopts"]} nfsroot={config["nfsroot"]}'
-        env_data = {
+        return {
             "SYSTEM_NAME"   : config['system_name'],
             "PROFILE"       : config['os']['profile'],
             "MAC_ADDRESS"   : config['mac_address'],
@@ -150,18 +795,12 @@ class Cobbler():
                 f'{ks_meta}'
                 )
         }
-        if self.add_system_ported_from_script(env_data, **opts) != 0:
-            self.util.print(" Unable to add system to cobbler!", quiet=opts['quiet'])
-            raise SystemError('Cobbler failure!')
-        self.util.print(" Done!")
-        sys.stdout.flush()
-        return True
 
     def remove_system(self, system_name, **kwargs):
         """
         This was originally a shell script that was called from a Jenkins server
-        running on the cobbler host. Manipulated the cobbler server directly
-        via subprocess and sets up the new cobbler system.
+        running on the cobbler host. Manipulates the cobbler server through
+        Cobbler.backend and sets up the new cobbler system.
 
         Args:
           - system_name (str): Name for the system in cobbler
@@ -174,29 +813,19 @@ class Cobbler():
         }
         opts.update(kwargs)
 
-        sbp_stdout = subprocess.DEVNULL if opts['quiet'] else subprocess.PIPE
-        p = subprocess.run([
-                '/bin/sh', '-c',
-                f'sudo docker exec  cobbler_container cobbler system report --name {system_name}'
-        ], stdout=sbp_stdout)
-        self.subproc_print(p, **opts)
-        if 'No profile found' in p.stdout.decode():
+        if not self.backend.exists('system', system_name):
             self.util.print(f'System {system_name} does not exist',
                             quiet=opts['quiet'])
         else:
             self.util.print(f'System {system_name} already exists, deleting...',
                             quiet=opts['quiet'])
-            p = subprocess.run([
-                '/bin/sh', '-c',
-                f'sudo docker exec  cobbler_container cobbler system remove --name={system_name}'
-            ], stdout=sbp_stdout)
-            self.subproc_print(p, **opts)
+            self.backend.remove('system', system_name)
 
     def add_system_ported_from_script(self, env, **kwargs):
         """
         This was originally a shell script that was called from a Jenkins server
-        running on the cobbler host. Manipulated the cobbler server directly
-        via subprocess and sets up the new cobbler system.
+        running on the cobbler host. Manipulates the cobbler server through
+        Cobbler.backend and sets up the new cobbler system.
 
         Args:
           - env (dict): All the required environment variables needed to tickle cobbler
@@ -214,55 +843,33 @@ class Cobbler():
         Keyword args:
           - quiet (bool): [False] Suppress status messages
           - debug (bool): [False] Print debug messages
+          - sync (bool): [True] Sync cobbler and print the listing afterwards. Turned off
+            by Cobbler.provision_systems, which syncs once for the whole batch
         Returns
             0 if successful, else non-zero
         """
         opts = {
             'quiet' : False,
-            'debug' : False
+            'debug' : False,
+            'sync'  : True
         }
         opts.update(kwargs)
 
-        sbp_stdout = subprocess.DEVNULL if opts['quiet'] else subprocess.PIPE
-
         self.remove_system(env['SYSTEM_NAME'], **opts)
 
-        cmdstr = (f'sudo docker exec  cobbler_container cobbler system add --name="{env["SYSTEM_NAME"]}" '
-                  f'--profile="{env["PROFILE"]}"')
-        self.util.print(f'Running {cmdstr}', quiet=opts['quiet'])
-        p = subprocess.run(['/bin/sh', '-c', cmdstr], stdout=sbp_stdout)
-        self.subproc_print(p, **opts)
-        cmdstr = (
-            f'sudo docker exec  cobbler_container cobbler system edit --name="{env["SYSTEM_NAME"]}" '
-            f'--mac="{env["MAC_ADDRESS"]}" --ip-address="{env["IP_ADDRESS"]}" '
-            f'--netmask="255.255.255.0" --static=1 --dns-name="{env["SYSTEM_NAME"]}" '
-            f'--interface="{env["NETDEV"]}" --gateway="{env["GATEWAY"]}" '
-            f'--netboot-enabled=true '
-            f'--hostname="{env["SYSTEM_NAME"].replace("_", "-")}" '
-            f'--kernel-options="{env["KOPTS"]}" '
-            f'--kernel-options-post="{env["KOPTS_POST"]}" '
-            f'--filename="grub/grubx64.efi" '
-            f'--autoinstall-meta="{env["KSMETASTRING"]}" '
-            )
-        self.util.print(f'Running {cmdstr}', quiet=opts['quiet'])
-
-        p = subprocess.run([
-                '/bin/sh', '-c',
-                cmdstr
-        ], stdout=sbp_stdout)
-        self.subproc_print(p, **opts)
-        if p.returncode == 0:
-            p = subprocess.run(['/bin/sh', '-c', 'sudo docker exec  cobbler_container cobbler sync'], stdout=sbp_stdout)
-            self.subproc_print(p, **opts)
-            p = subprocess.run([
-                'sudo', 'docker', 'exec', 'cobbler_container', 'cobbler', 'system', 'report', '--name', env['SYSTEM_NAME']
-                ], stdout=sbp_stdout)
-            self.subproc_print(p, **opts)
-            return_val = p.returncode
-        else:
-            return_val = 1
-        p = subprocess.run(['/bin/sh', '-c', 'sudo docker exec  cobbler_container cobbler list'], stdout=sbp_stdout)
-        self.util.print(f'{p.stdout.decode()}')
+        self.util.print(f'Adding system {env["SYSTEM_NAME"]} with profile {env["PROFILE"]}',
+                        quiet=opts['quiet'])
+        return_val = 1
+        fields, interface = self._system_fields(env)
+        if self.backend.add('system', env['SYSTEM_NAME'], {'profile': fields.pop('profile')}) \
+                and self.backend.edit('system', env['SYSTEM_NAME'], fields, interface=interface):
+            if opts['sync']:
+                self.sync(quiet=opts['quiet'])
+            if opts['debug']:
+                self.util.print(self.backend.report('system', env['SYSTEM_NAME']))
+            return_val = 0 if self.backend.exists('system', env['SYSTEM_NAME']) else 1
+        if opts['sync']:
+            self.util.print(self.backend.listing())
         return return_val
 
     def remove_profile(self, osconfig, **kwargs):
@@ -272,53 +879,150 @@ class Cobbler():
         Keyword args:
           - quiet (bool): [False] Suppress status messages
           - debug (bool): [False] Print debug messages
+          - distro (bool): [True] Also remove the profile's distro, so that the ISO is
+            imported again even if it hasn't changed
         Raises:
         Returns:
             True if successful, else False
         """
         opts = {
-            'quiet' : False,
-            'debug' : False
+            'quiet'     : False,
+            'debug'     : False,
+            'distro'    : True
         }
         opts.update(kwargs)
         self.util.print(f'Remove Profile {osconfig["profile"]}.')
 
-        sbp_stdout = subprocess.DEVNULL if opts['quiet'] else subprocess.PIPE
-        p = subprocess.run([
-            '/bin/sh', '-c', f'sudo docker exec  cobbler_container cobbler profile report --name {osconfig["profile"]}'
-        ], stdout=sbp_stdout)
-        self.subproc_print(p, **opts)
-        if 'No profile found' in p.stdout.decode():
+        if not self.backend.exists('profile', osconfig['profile']):
             self.util.print(f'Profile {osconfig["profile"]} does not exist.')
             return True
 
-        cmd = f'sudo docker exec  cobbler_container cobbler profile remove --name {osconfig["profile"]}'
-        p = subprocess.run(['/bin/sh', '-c', cmd], stdout=sbp_stdout)
-        self.subproc_print(p, **opts)
-        if p.returncode != 0:
-            self.util.print(f'Failed to run {cmd}')
+        if not self.backend.remove('profile', osconfig['profile']):
+            self.util.print(f'Failed to remove profile {osconfig["profile"]}')
             return False
 
-        self.util.print(f'Remove Distro {osconfig["distro"]-x86_64}.')
-        cmd = f'sudo docker exec  cobbler_container cobbler distro remove --name {osconfig["distro"]}-x86_64'
-        p = subprocess.run(['/bin/sh', '-c', cmd], stdout=sbp_stdout)
-        self.subproc_print(p, **opts)
-        if p.returncode != 0:
-            self.util.print(f'Failed to run {cmd}')
+        if not opts['distro']:
+            return True
+        self.util.print(f'Remove Distro {osconfig["distro"]}-x86_64.')
+        if not self.backend.remove('distro', f'{osconfig["distro"]}-x86_64'):
+            self.util.print(f'Failed to remove distro {osconfig["distro"]}-x86_64')
             return False
 
         return True
 
+    def iso_digest(self, path, **kwargs):
+        """
+        Returns a sampled sha256 of an ISO: its size plus 64 1MiB chunks spread evenly over
+        it, enough to tell apart any two installer images. Hashes are cached by path,
+        mtime and size in Util.local_filepaths['isos'], so an unchanged ISO costs one stat.
+        The ISO is read on the host if it is there, else inside the cobbler container.
+
+        Args:
+          - path (str): Path to the ISO, as in os.json
+        Keyword args:
+          - quiet (bool): [False] Suppress status messages
+        Raises:
+          - IOError if the ISO can't be read
+        Returns:
+            The hex digest
+        """
+        opts = {
+            'quiet' : False
+        }
+        opts.update(kwargs)
+
+        cachefile = self.util.local_filepaths['isos']
+        with self._iso_lock:
+            try:
+                with open(cachefile) as cfile:
+                    cached = json.load(cfile).get(path, {})
+            except (OSError, ValueError):
+                cached = {}
+        args = [path, str(cached.get('mtime')), str(cached.get('size'))]
+        if os.path.isfile(path):
+            cmd = [sys.executable, '-c', self._ISO_DIGEST, *args]
+        else:
+            cmd = ['sudo', 'docker', 'exec', 'cobbler_container',
+                   'python3', '-c', self._ISO_DIGEST, *args]
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise IOError(f"Could not read ISO '{path}': {proc.stderr.decode().strip()}")
+        lines = proc.stdout.decode().split()
+        if len(lines) == 2:
+            return cached['digest']
+
+        self.util.print(f'Hashed {path}', quiet=opts['quiet'])
+        with self._iso_lock:
+            try:
+                with open(cachefile) as cfile:
+                    data = json.load(cfile)
+            except (OSError, ValueError):
+                data = {}
+            data[path] = {'mtime': int(lines[0]), 'size': int(lines[1]), 'digest': lines[2]}
+            os.makedirs(os.path.dirname(cachefile), exist_ok=True)
+            with open(f'{cachefile}.tmp', 'w') as cfile:
+                json.dump(data, cfile, indent=2)
+            os.replace(f'{cachefile}.tmp', cachefile)
+        return lines[2]
+
+    def imported_digest(self, distro):
+        """
+        Returns the ISO digest recorded on a distro by Cobbler.create_profile_if_missing,
+        '' for a distro imported some other way, or None if the distro doesn't exist
+        """
+        item = self.backend.get('distro', distro)
+        if item is None:
+            return None
+        comment = item.get('comment') or ''
+        return comment[len(self._ISO_COMMENT):] if comment.startswith(self._ISO_COMMENT) else ''
+
+    def create_profiles(self, configs, **kwargs):
+        """
+        Runs Cobbler.create_profile_if_missing for many profiles, importing distinct ISOs
+        concurrently. Profiles sharing a distro are created one after the other.
+
+        Args:
+          - configs (list): Formatted configuration dicts from util.Util.build_config
+        Keyword args:
+          - workers (int): [4] How many imports may run at once
+          - see Cobbler.create_profile_if_missing
+        Raises:
+          - SystemError if a profile could not be created
+        """
+        opts = {
+            'workers'   : 4,
+            'quiet'     : False
+        }
+        opts.update(kwargs)
+
+        distros = {}
+        for config in configs:
+            distros.setdefault(config['os']['distro'], []).append(config)
+
+        def create(group):
+            for config in group:
+                if not self.create_profile_if_missing(config, **opts):
+                    raise SystemError('Could not find or create a cobbler profile named '
+                                      f'{config["os"]["profile"]}.')
+
+        graph = TaskGraph(workers=opts['workers'])
+        for distro, group in distros.items():
+            graph.add(distro, lambda group=group: create(group))
+        graph.run()
+
     def create_profile_if_missing(self, tgt_cfg, **kwargs):
         """
         Checks the local cobbler server for the OS specified in config, and attempts to
-        import the OS if possible.
+        import the OS if possible. The distro is imported again only if the ISO's content
+        changed since it was imported (see Cobbler.iso_digest); a distro imported without
+        a recorded digest is kept and adopted.
 
         Args:
           - osconfig (dict): Just the 'os' config field from util.Util.build_config
         Keyword args:
           - quiet (bool): [False] Suppress status messages
           - debug (bool): [False] Print debug messages
+          - sync (bool): [True] Sync cobbler after creating the profile
         Raises:
           - IOError if supplied with an invalid filepath for an ISO to import
         Returns:
@@ -326,7 +1030,8 @@ class Cobbler():
         """
         opts = {
             'quiet' : False,
-            'debug' : False
+            'debug' : False,
+            'sync'  : True
         }
         opts.update(kwargs)
         osconfig = tgt_cfg['os']
@@ -334,11 +1039,7 @@ class Cobbler():
 
         # check existing profiles for a match
         self.util.print(f'Checking profile {osconfig["profile"]}', quiet=opts['quiet'])
-        p = subprocess.run([
-            '/bin/sh', '-c', f'sudo docker exec  cobbler_container cobbler profile report --name {osconfig["profile"]}'
-        ], stdout = sbp_stdout)
-        self.subproc_print(p, **opts)
-        if 'No profile found' not in p.stdout.decode():
+        if self.backend.exists('profile', osconfig['profile']):
             self.util.print(f'Profile exists {osconfig["profile"]}', quiet=opts['quiet'])
             return True
         else:
@@ -356,13 +1057,33 @@ class Cobbler():
         self.util.print(f'Mounting inside docker {osconfig["path"]} -> {mntpath}', quiet=opts['quiet'])
         try:
 
-            # detect distro, if not found import fresh
-            self.util.print(f'Looking for existing distro {osconfig["profile"]}-x86_64')
-            p = subprocess.run([
-                '/bin/sh', '-c', f'sudo docker exec  cobbler_container cobbler distro report --name {osconfig["profile"]}-x86_64'
-            ], stdout = sbp_stdout)
-            self.subproc_print(p, **opts)
-            if 'No distro found' in p.stdout.decode():
+            # detect distro, if not found or imported from another ISO import fresh
+            distro = f'{osconfig["distro"]}-x86_64'
+            self.util.print(f'Looking for existing distro {distro}')
+            digest = self.iso_digest(osconfig['path'], quiet=opts['quiet'])
+            imported = self.imported_digest(distro)
+            if imported == '':
+                self.util.print(f'Adopting distro {distro} for {osconfig["path"]}')
+                if not self.backend.edit('distro', distro,
+                                         {'comment': f'{self._ISO_COMMENT}{digest}'}):
+                    raise SystemError(f'Could not edit distro {distro}')
+            elif imported != digest:
+                if imported is not None:
+                    # only replace the old distro if nothing but the profile its import
+                    # made still uses it, so no other profile or system goes with it
+                    self.util.print(f'{osconfig["path"]} changed since {distro} was imported')
+                    users = sorted(name for name, profile in
+                                   self.backend.inventory()['profile'].items()
+                                   if profile.get('distro') == distro and name != distro)
+                    if users:
+                        raise SystemError(f'Cannot import {osconfig["path"]} over {distro}, '
+                                          f'profiles {", ".join(users)} still use it. Remove '
+                                          f'them first or reload them with this one')
+                    if self.backend.exists('profile', distro) and \
+                            not self.backend.remove('profile', distro):
+                        raise SystemError(f'Could not remove profile {distro}')
+                    if not self.backend.remove('distro', distro):
+                        raise SystemError(f'Could not remove distro {distro}')
                 try:
                     self.util.print(f'Create folder {mntpath}')
                     subprocess.run(['sudo', 'docker', 'exec', 'cobbler_container', 'mkdir', '-p', mntpath], check=True)
@@ -386,35 +1107,21 @@ class Cobbler():
                     subprocess.run(['sudo', 'docker', 'exec', 'cobbler_container', 'umount', mntpath], stdout=subprocess.DEVNULL)
                 # Add tree
                 self.util.print('Add tree metadata')
-                p = subprocess.run(['/bin/sh', '-c',
-                                (
-                                    f'sudo docker exec  cobbler_container cobbler distro edit --name={osconfig["distro"]}-x86_64 '
-                                    f'--autoinstall-meta="tree=http://@@http_server@@/cblr/links/{osconfig["distro"]}-x86_64" '
-                                )
-                                ], check=True, stdout=sbp_stdout)
-                self.subproc_print(p, **opts)
-                self.util.print('Distro Report')
-                p = subprocess.run(['/bin/sh', '-c',
-                                (
-                                    f'sudo docker exec  cobbler_container cobbler distro report --name={osconfig["distro"]}-x86_64 '
-                                )
-                                ], check=True, stdout=sbp_stdout)
-                self.subproc_print(p, **opts)
-                self.util.print('Profile Report')
-                p = subprocess.run(['/bin/sh', '-c',
-                                (
-                                    f'sudo docker exec  cobbler_container cobbler profile report --name={osconfig["distro"]}-x86_64 '
-                                )
-                                ], check=True, stdout=sbp_stdout)
-                self.subproc_print(p, **opts)
+                if not self.backend.edit('distro', distro, {
+                        'autoinstall_meta': f'tree=http://@@http_server@@/cblr/links/{distro}',
+                        'comment': f'{self._ISO_COMMENT}{digest}'}):
+                    raise SystemError(f'Could not edit distro {distro}')
+                if opts['debug']:
+                    self.util.print('Distro Report')
+                    self.util.print(self.backend.report('distro', distro))
+                    self.util.print('Profile Report')
+                    self.util.print(self.backend.report('profile', distro))
                 # delete and recreate the profile
                 self.util.print('Removing new profile')
-                p = subprocess.run(['/bin/sh', '-c',
-                                f'sudo docker exec  cobbler_container cobbler profile remove --name={osconfig["distro"]}-x86_64'
-                                ], check=True, stdout=sbp_stdout)
-                self.subproc_print(p, **opts)
+                if not self.backend.remove('profile', distro):
+                    raise SystemError(f'Could not remove profile {distro}')
             else:
-                self.util.print('Distro found in cobbler')
+                self.util.print('Distro found in cobbler, imported from this ISO')
 
             # load in the kickstart
             self.util.print('Assigning kickstart file - copy from {self.util.local_filepaths["repo_dir"]}')
@@ -426,23 +1133,17 @@ class Cobbler():
                             ksfile
                             ], check=True, stdout=sbp_stdout)
             self.util.print('Creating new profile')
-            subprocess.run(['/bin/sh', '-c',
-                            (
-                                f'sudo docker exec  cobbler_container cobbler profile add --name={osconfig["profile"]} '
-                                f'--distro={osconfig["distro"]}-x86_64 '
-                                f'--autoinstall={osconfig["profile"]}.ks'
-                            )
-                            ], check=True, stdout=sbp_stdout)
-            self.util.print('Profile Report')
-            p = subprocess.run(['/bin/sh', '-c',
-                            (
-                                f'sudo docker exec  cobbler_container cobbler profile report --name={osconfig["profile"]}'
-                            )
-                            ], check=True, stdout=sbp_stdout)
-            self.subproc_print(p, **opts)
+            if not self.backend.add('profile', osconfig['profile'], {
+                    'distro'        : f'{osconfig["distro"]}-x86_64',
+                    'autoinstall'   : f'{osconfig["profile"]}.ks'}):
+                raise SystemError(f'Could not add profile {osconfig["profile"]}')
+            if opts['debug']:
+                self.util.print('Profile Report')
+                self.util.print(self.backend.report('profile', osconfig['profile']))
             # sync it up
             self.util.print('Sync')
-            subprocess.run(['sudo', 'docker', 'exec', 'cobbler_container', 'cobbler', 'sync'], check=True, stdout=sbp_stdout)
+            if opts['sync'] and not self.sync(quiet=opts['quiet']):
+                raise SystemError('cobbler sync failed')
 
         except Exception as exc:
             self.util.print('That didn\'t work. Failing out...', quiet=opts['quiet'])
@@ -463,10 +1164,14 @@ def main():
         'reload'        : False,
         'quiet'         : False,
         'list_os'       : False,
-        'debug'         : False
+        'debug'         : False,
+        'backend'       : 'auto',
+        'systems'       : '',
+        'prune'         : False,
+        'dry_run'       : False
     })
 
-    COBBLER = Cobbler(repo_dir=ARGS['repo_dir'], quiet=ARGS['quiet'])
+    COBBLER = Cobbler(repo_dir=ARGS['repo_dir'], quiet=ARGS['quiet'], backend=ARGS['backend'])
 
     if ARGS['list_os']:
         OS = COBBLER.util.get_os_config()['os']
@@ -478,6 +1183,26 @@ def main():
                 print(_os)
         exit(0)
 
+    if ARGS['systems']:
+        # comma separated pconfig globs, e.g. 'config/systems/rack2-*.json'
+        CFGS = [COBBLER.util.build_config(pconfig=pconfig,
+                                          override_ip='',
+                                          tgt_os=ARGS['tgt_os'],
+                                          quiet=ARGS['quiet'])
+                for _, pconfig in COBBLER.util.find_pconfigs(ARGS['systems'].split(','),
+                                                             quiet=ARGS['quiet'])]
+        RESULTS = COBBLER.provision_systems(CFGS,
+                                            force=ARGS['force'],
+                                            reload=ARGS['reload'],
+                                            quiet=ARGS['quiet'],
+                                            debug=ARGS['debug'],
+                                            prune=ARGS['prune'],
+                                            dry_run=ARGS['dry_run'],
+        )
+        print(json.dumps(RESULTS, indent=2))
+        sys.stdout.flush()
+        exit(0 if all(RESULTS.values()) else 1)
+
     CFG = COBBLER.util.build_config(
         pconfig=ARGS['pconfig'],
         override_ip=ARGS['override_ip'],
@@ -3,17 +3,34 @@
 import sys
 import os
 import json
+import time
+import uuid
+import threading
+import shlex
+import hashlib
+import tempfile
+import subprocess
+import functools
+import http.server
+import urllib.parse
 from string import ascii_letters
 from random import choice
+import paramiko
 try:
-    from .util import Util
+    from .util import Util, TaskGraph
 except ImportError:
-    from util import Util
+    from util import Util, TaskGraph
 try:
     from .validator import Validator
 except ImportError:
     from validator import Validator
 
+class _CacheRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves the package cache without logging each request to stderr"""
+
+    def log_message(self, format, *args):
+        pass
+
 class Dependencies():
     """
     Controls the configuration of the machine as defined in a config file in 6 steps:
@@ -39,6 +56,12 @@ class Dependencies():
     dpnd = Dependencies(util=util)
     ```
     """
+    _REPO_DIR = '/etc/yum.repos.d'
+    _CACHE_PORT = 8765
+    _CACHE_LIST = '/etc/apt/sources.list.d/aslinuxtester-cache.list'
+    _cache_servers = {}
+    _cache_lock = threading.Lock()
+
 
     def __init__(self, **kwargs):
         """
@@ -70,18 +93,37 @@ class Dependencies():
     def install_all(self, tgt_cfg, **kwargs):
         """
         Installs all dependencies defined in the pconfig, in the order described in
-        the module docstring above.
+        the module docstring above. Steps are run as a TaskGraph: repos, keyfiles and
+        the upload of every phase's scripts run at the same time, the script and package
+        steps follow one after another, and the critical path is printed at the end.
+
+        Each step's inputs are fingerprinted (see Dependencies.fingerprint) and the
+        fingerprints of finished steps are kept on the target at
+        Util.remote_filepaths['fingerprints']. Steps whose fingerprint hasn't changed since
+        they last ran are skipped, so changing one driver script only reruns the drivers.
+
+        Progress of the run is kept in a journal on the host
+        (Util.local_filepaths['journal']) and on the target
+        (Util.remote_filepaths['journal']) until the run finishes. If a run is cut short,
+        the next one resumes after the last finished step, even with force set, unless
+        restart is set. A step whose inputs changed in between runs again.
 
         Args:
           - tgt_cfg (dict): The configuration of the target from Util.build_config
         Keyword args:
-          - force (bool): [False] Skip target config checking and start the installations
+          - force (bool): [False] Ignore recorded fingerprints and run every step
+          - restart (bool): [False] Discard the journal of an unfinished run and start over
+          - workers (int): [4] How many steps can run at once
           - quiet (bool): [False] Set to true to hide status messages
           - attempts (int): [100] How many times to retry connection
           - delay (int): [10] How long to wait between retries
+        Returns:
+            The list of steps that ran
         """
         opts = {
             'force'     : False,
+            'restart'   : False,
+            'workers'   : 4,
             'quiet'     : False,
             'attempts'  : 100,
             'delay'     : 10
@@ -98,22 +140,96 @@ class Dependencies():
         #if self.util.iboot:
         #    self.util.reboot(tgt_cfg)
 
-        # check if already installed
-        if not opts['force'] and self.util.check_target_config(tgt_cfg, quiet=opts['quiet']):
-            return
+        if 'ansible_file' in tgt_cfg:
+            steps = ['repos', 'keyfiles', 'ansible']
         else:
+            steps = ['repos', 'keyfiles', 'prereqs', 'packages', 'postreqs', 'drivers']
+        rfile = self.util.remote_filepaths['fingerprints']
+
+        recorded = {}
+        if opts['force']:
             self.util.print("Forcing provisioning on target...")
+        else:
+            recorded = self.util.read_remote_json(rfile)
+            if recorded is None:
+                recorded = {}
+                # provisioned before steps were fingerprinted, trust the whole-config check
+                if self.util.check_target_config(tgt_cfg, quiet=opts['quiet']):
+                    self.util.write_remote_json(
+                        rfile, {step: self.fingerprint(tgt_cfg, step) for step in steps})
+                    return []
 
-        # start installing stuff
-        self.install_repos(tgt_cfg)
-        self.install_keyfiles(tgt_cfg)
-        if 'ansible_file' in tgt_cfg:
-            self.install_ansible(tgt_cfg)
+        journal = None if opts['restart'] else self._load_journal(tgt_cfg)
+        if journal:
+            self.util.print(f'Resuming the provisioning run started {journal["started"]}',
+                            quiet=opts['quiet'])
+            if journal['failed']:
+                self.util.print(f'It failed at {journal["failed"]["step"]}: '
+                                f'{journal["failed"]["error"]}', quiet=opts['quiet'])
+            journal['failed'] = None
         else:
-            self.install_prereqs(tgt_cfg)
-            self.install_packages(tgt_cfg)
-            self.install_postreqs(tgt_cfg)
-            self.install_drivers(tgt_cfg)
+            journal = {
+                'id'        : uuid.uuid4().hex,
+                'started'   : time.strftime('%Y-%m-%d %H:%M:%S'),
+                'done'      : {},
+                'failed'    : None
+            }
+        self._save_journal(tgt_cfg, journal)
+
+        fingerprints = {}
+        def pending(step):
+            if step not in fingerprints:
+                fingerprints[step] = self.fingerprint(tgt_cfg, step)
+            return fingerprints[step] not in (recorded.get(step), journal['done'].get(step))
+
+        ran = []
+        lock = threading.Lock()
+        def run_step(step):
+            if not pending(step):
+                self.util.print(f'Skipping {step}, unchanged since it last ran',
+                                quiet=opts['quiet'])
+                with lock:
+                    recorded[step] = fingerprints[step]
+                return
+            try:
+                getattr(self, f'install_{step}')(tgt_cfg)
+            except Exception as exc:
+                with lock:
+                    journal['failed'] = {'step': step, 'error': str(exc) or repr(exc)}
+                    self._save_journal(tgt_cfg, journal)
+                raise
+            with lock:
+                ran.append(step)
+                recorded[step] = journal['done'][step] = fingerprints[step]
+                self._save_journal(tgt_cfg, journal)
+                try:
+                    self.util.write_remote_json(rfile, recorded)
+                except (paramiko.ssh_exception.SSHException, OSError, EOFError):
+                    # the step rebooted the target, it's recorded after reconnecting below
+                    pass
+
+        graph = TaskGraph(workers=opts['workers'])
+        graph.add('repos', lambda: run_step('repos'))
+        graph.add('keyfiles', lambda: run_step('keyfiles'))
+        if 'ansible' in steps:
+            graph.add('ansible', lambda: run_step('ansible'), after=['repos', 'keyfiles'])
+        else:
+            graph.add('stage', lambda: self._stage_scripts(
+                tgt_cfg, [step for step in ('prereqs', 'postreqs', 'drivers') if pending(step)],
+                quiet=opts['quiet']))
+            graph.add('prereqs', lambda: run_step('prereqs'), after=['repos', 'keyfiles', 'stage'])
+            graph.add('packages', lambda: run_step('packages'), after=['prereqs'])
+            graph.add('postreqs', lambda: run_step('postreqs'), after=['packages'])
+            graph.add('drivers', lambda: run_step('drivers'), after=['postreqs'])
+        try:
+            graph.run()
+        finally:
+            path = graph.critical_path()
+            if path:
+                self.util.print('Critical path: ' +
+                                ' -> '.join(f'{name} {end - start:.1f}s'
+                                            for name, start, end in path) +
+                                f' ({path[-1][2]:.1f}s total)', quiet=opts['quiet'])
 
         # Reconnect in case of reboot in scripts
         self.util.connect(tgt_cfg, **{
@@ -123,7 +239,144 @@ class Dependencies():
                           })
 
         # mark as completely installed
+        self.util.write_remote_json(rfile, {step: recorded[step] for step in steps})
         self.util.set_target_config(tgt_cfg, quiet=opts['quiet'])
+        self._clear_journal(tgt_cfg)
+        return ran
+
+    def _stage_scripts(self, cfg, steps, **kwargs):
+        """
+        Sends the scripts of the given script steps ('prereqs', 'postreqs', 'drivers') to
+        the target ahead of time, so the steps only have to check them when they run.
+        """
+        opts = {
+            'quiet' : False
+        }
+        opts.update(kwargs)
+
+        for step in steps:
+            phase = {'prereqs'  : 'prereqscripts',
+                     'postreqs' : 'postreqscripts',
+                     'drivers'  : 'driverscripts'}[step]
+            ldir = self.util.local_filepaths[phase]
+            if not ldir or not os.path.isdir(ldir):
+                continue
+            if step == 'drivers':
+                scripts = [scr for scr in sorted(cfg.get('drivers', []))
+                           if os.path.isfile(os.path.join(ldir, scr))]
+            else:
+                scripts = cfg[step] if step in cfg else sorted(os.listdir(ldir))
+            if scripts:
+                self.util.copy_file(ldir, self.util.remote_filepaths[phase], members=scripts,
+                                    perm=0o711, sync='mtime', quiet=opts['quiet'])
+
+    def _journal_path(self, tgt_cfg):
+        """
+        Returns the path of the host-side journal for a target
+        """
+        return f'{self.util.local_filepaths["journal"]}/{self.util.target_name(tgt_cfg)}.json'
+
+    def _load_journal(self, tgt_cfg):
+        """
+        Returns the journal of an unfinished install_all run on the target, or None. The
+        target's copy decides whether there is one, so a reimaged target starts over. The
+        host's copy is preferred when both are of the same run, as it is written first
+        and survives steps that drop the connection.
+        """
+        remote = self.util.read_remote_json(self.util.remote_filepaths['journal'])
+        if not remote:
+            return None
+        try:
+            with open(self._journal_path(tgt_cfg), 'r') as jfile:
+                local = json.load(jfile)
+        except (OSError, ValueError):
+            local = None
+        if local and local.get('id') == remote.get('id'):
+            return local
+        return remote
+
+    def _save_journal(self, tgt_cfg, journal):
+        """
+        Writes the journal to the host, then mirrors it to the target if it is reachable
+        """
+        path = self._journal_path(tgt_cfg)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'w') as jfile:
+            json.dump(journal, jfile, indent=2)
+        os.replace(f'{path}.tmp', path)
+        try:
+            self.util.write_remote_json(self.util.remote_filepaths['journal'], journal)
+        except (paramiko.ssh_exception.SSHException, OSError, EOFError):
+            pass
+
+    def _clear_journal(self, tgt_cfg):
+        """
+        Removes both copies of the journal once a run has finished
+        """
+        try:
+            os.remove(self._journal_path(tgt_cfg))
+        except FileNotFoundError:
+            pass
+        self.util.run_command(f'rm -f {shlex.quote(self.util.remote_filepaths["journal"])}',
+                              quiet=True)
+
+    def fingerprint(self, cfg, step):
+        """
+        Hashes everything that decides what one install_all step does to the target: its
+        settings from cfg and the contents of the local files it sends. The packages
+        fingerprint includes the repos one, as new repos can change what gets installed.
+
+        Args:
+          - cfg (dict): The configuration of the target from Util.build_config
+          - step (str): One of 'repos', 'keyfiles', 'prereqs', 'packages', 'postreqs',
+            'drivers' or 'ansible'
+        Returns:
+            A sha256 hex digest
+        Raises:
+          - ValueError if step isn't known
+        """
+        paths = self.util.local_filepaths
+        if step == 'repos':
+            repos = cfg['os'].get('repos')
+            inputs = [self._render_repo(repo) for repo in repos] if isinstance(repos, list) else []
+        elif step == 'keyfiles':
+            inputs = self._files_digest(paths['sshconfig'])
+        elif step in ('prereqs', 'postreqs'):
+            scripts = paths['prereqscripts' if step == 'prereqs' else 'postreqscripts']
+            inputs = [cfg.get(step), self._files_digest(scripts, cfg.get(step))]
+        elif step == 'packages':
+            inputs = [cfg['os'].get('packages'), self.fingerprint(cfg, 'repos')]
+        elif step == 'drivers':
+            drivers = sorted(cfg.get('drivers', []))
+            inputs = [drivers, self._files_digest(paths['driverscripts'], drivers)]
+        elif step == 'ansible':
+            inputs = [cfg, self._files_digest(paths['repo_dir'], [cfg['ansible_file']])]
+        else:
+            raise ValueError(f'Unknown install step {step}')
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def _files_digest(directory, names=None):
+        """
+        Returns [name, sha256] pairs for the given files in directory, or for every file
+        in it if names is None. Missing files hash to None.
+        """
+        if not directory or not os.path.isdir(directory):
+            return None
+        if names is None:
+            names = sorted(name for name in os.listdir(directory)
+                           if os.path.isfile(os.path.join(directory, name)))
+        digests = []
+        for name in names:
+            try:
+                digest = hashlib.sha256()
+                with open(os.path.join(directory, name), 'rb') as lfile:
+                    for chunk in iter(lambda: lfile.read(1 << 20), b''):
+                        digest.update(chunk)
+                digests.append([name, digest.hexdigest()])
+            except OSError:
+                digests.append([name, None])
+        return digests
 
     def install_repos(self, cfg, **kwargs):
         """
@@ -151,36 +404,99 @@ class Dependencies():
 
         self.util.print("Attempting to install configured repos...")
 
-        ret = 0
-        repos = opts['extrarepos']
+        repos = list(opts['extrarepos'])
         if 'repos' in cfg['os'] and isinstance(cfg['os']['repos'], list):
             repos.extend(cfg['os']['repos'])
 
-        for repo in repos:
-            self.util.print(f'Installing {repo["name"]}.repo...', quiet=opts['quiet'])
-            self.util.run_command((f'echo "[{repo["name"]}]" > '
-                                   f'{repo["name"]}.repo'), quiet=True)
-            self.util.run_command((f'echo "name={repo["name"]}" >> '
-                                   f'{repo["name"]}.repo'), quiet=True)
-            self.util.run_command((f'echo "baseurl={repo["baseurl"]}" >> '
-                                   f'{repo["name"]}.repo'), quiet=True)
-            self.util.run_command((f'echo "enabled=1" >> '
-                                   f'{repo["name"]}.repo'), quiet=True)
-            if 'extraoptions' in repo and isinstance(repo['extraoptions'], dict):
-                for opt in repo['extraoptions']:
-                    self.util.run_command((f'sed -i "/{opt}=/d" '
-                                           f'{repo["name"]}.repo'), quiet=True)
-                    self.util.run_command((f'echo "{opt}={repo["extraoptions"][opt]}" >> '
-                                           f'{repo["name"]}.repo'), quiet=True)
-
-            # move it on up
-            if self.util.run_command((f'sudo -E mv {repo["name"]}.repo '
-                                      f'/etc/yum.repos.d/{repo["name"]}.repo')) == 0:
+        return self._install_repo_files(
+            {f'{repo["name"]}.repo': self._render_repo(repo) for repo in repos},
+            quiet=opts['quiet'])
+
+    def _install_repo_files(self, rendered, **kwargs):
+        """
+        Installs .repo files rendered on the host. Files the target already has with the
+        same contents are skipped, the rest are sent in one tar stream and renamed into
+        place by one sudo command.
+
+        Args:
+          - rendered (dict): File contents by .repo file name
+        Keyword args:
+          - quiet (bool): [False] Set to true to hide status messages
+        Returns:
+            The number of repo files in place
+        """
+        opts = {
+            'quiet' : False
+        }
+        opts.update(kwargs)
+
+        ret = 0
+        if not rendered:
+            return ret
+        installed = self._installed_repo_hashes(list(rendered))
+        changed = []
+        for name, content in rendered.items():
+            if installed.get(name) == hashlib.sha256(content.encode()).hexdigest():
+                self.util.print(f'{name} is up to date', quiet=opts['quiet'])
                 ret += 1
             else:
-                self.util.print(f'Installation of {repo["name"]}.repo failed!', quiet=opts['quiet'])
+                self.util.print(f'Installing {name}...', quiet=opts['quiet'])
+                changed.append(name)
+        if not changed:
+            return ret
+
+        staging = self.util.remote_filepaths['repos']
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in changed:
+                with open(os.path.join(tmpdir, name), 'w') as repof:
+                    repof.write(rendered[name])
+            self.util.copy_file(tmpdir, staging, bulk=True, perm=0o644, quiet=True)
+
+        # write each file next to its final path and rename it over, so yum never sees
+        # a partial file
+        names = ' '.join(shlex.quote(name) for name in changed)
+        script = (f'for f in {names}; do '
+                  f'install -m 644 {shlex.quote(staging)}/"$f" {self._REPO_DIR}/."$f".tmp && '
+                  f'mv -f {self._REPO_DIR}/."$f".tmp {self._REPO_DIR}/"$f" || exit 1; done')
+        if self.util.run_command(f'sudo -E sh -c {shlex.quote(script)} && '
+                                 f'rm -rf {shlex.quote(staging)}', quiet=opts['quiet']) == 0:
+            ret += len(changed)
+        else:
+            for name in changed:
+                self.util.print(f'Installation of {name} failed!', quiet=opts['quiet'])
         return ret
 
+    @staticmethod
+    def _render_repo(repo):
+        """
+        Builds the contents of the .repo file for one repo definition from os.json. Each
+        of its extraoptions replaces any line already setting that option.
+        """
+        lines = [f'[{repo["name"]}]',
+                 f'name={repo["name"]}',
+                 f'baseurl={repo["baseurl"]}',
+                 'enabled=1']
+        if 'extraoptions' in repo and isinstance(repo['extraoptions'], dict):
+            for opt in repo['extraoptions']:
+                lines = [line for line in lines if f'{opt}=' not in line]
+                lines.append(f'{opt}={repo["extraoptions"][opt]}')
+        return '\n'.join(lines) + '\n'
+
+    def _installed_repo_hashes(self, names):
+        """
+        Returns a dict of sha256 hashes of the given .repo files in the target's repo
+        directory, by file name. Missing files are left out.
+        """
+        out = self.util.run_command(
+            f'cd {self._REPO_DIR} && sha256sum -- {" ".join(shlex.quote(n) for n in names)} '
+            f'2>/dev/null', stdout=True, quiet=True)
+        hashes = {}
+        for line in (out or '').splitlines():
+            digest, _, name = line.partition('  ')
+            if name:
+                hashes[name] = digest
+        return hashes
+
     # these are necessary to pull files passwordless from git
     # sshconfig key will need to be configured in someones gitlab account
     def install_keyfiles(self, cfg, **kwargs):
@@ -218,14 +534,13 @@ class Dependencies():
 
             #if not os.path.dirname(rem_ssh_folder) in opts['ftp_client'].listdir(os.path.basename(rem_ssh_folder):
             #opts['ftp_client'].mkdir(rem_ssh_folder)
-            for sshconf in os.listdir(self.util.local_filepaths['sshconfig']):
-                lfile = f'{self.util.local_filepaths["sshconfig"]}/{sshconf}'
-                rfile = f'{self.util.remote_filepaths["sshconfig"]}/{sshconf}'
-                ret += self.util.copy_file(
-                    lfile,
-                    rfile,
-                    perm=0o600,
-                    quiet=opts['quiet'])
+            # only keyfiles that differ from the target's copies are sent
+            ret = self.util.copy_file(
+                self.util.local_filepaths['sshconfig'],
+                self.util.remote_filepaths['sshconfig'],
+                perm=0o600,
+                sync='hash',
+                quiet=opts['quiet'])
             self.util.run_command('chmod 700 ~/.ssh', quiet=True, strict=True)
 
         return ret
@@ -273,6 +588,8 @@ class Dependencies():
           - ignore_scripts (list): [[]] List of script names to ignore
           - quiet (bool): [False] Set to true to hide status messages
           - strict (bool): [True] Throw an error if a prereq script fails
+          - bundle (bool): [True] Send all scripts at once and run them through one remote
+            runner (see Dependencies._run_bundle) instead of one copy and run per script
         Returns:
             The number of scripts run
         Raises:
@@ -282,7 +599,8 @@ class Dependencies():
         opts = {
             'ignore_scripts'    : [],
             'quiet'             : False,
-            'strict'            : True
+            'strict'            : True,
+            'bundle'            : True
         }
         opts.update(kwargs)
         self.util.connect(cfg)
@@ -301,9 +619,16 @@ class Dependencies():
                 self.util.print(f'Prereqs list set to {cfg["prereqs"]} from config file',
                                 quiet=opts['quiet'])
                 scriptlist = cfg['prereqs']
+            skipped = [scr for scr in scriptlist if scr in opts['ignore_scripts']]
+            for scr in skipped:
+                self.util.print(f'Skipping {scr}', quiet=opts['quiet'])
+            if opts['bundle']:
+                results = self._run_bundle('prereqscripts',
+                                           [scr for scr in scriptlist if scr not in skipped],
+                                           quiet=opts['quiet'], strict=opts['strict'])
+                return sum(1 for code in results.values() if code == 0)
             for scr in scriptlist:
-                if scr in opts['ignore_scripts']:
-                    self.util.print(f'Skipping {scr}', quiet=opts['quiet'])
+                if scr in skipped:
                     continue
                 lscript = f'{self.util.local_filepaths["prereqscripts"]}/{scr}'
                 rscript = f'{self.util.remote_filepaths["prereqscripts"]}/{scr}'
@@ -311,6 +636,7 @@ class Dependencies():
                     lscript,
                     rscript,
                     perm=0o711,
+                    sync='mtime',
                     quiet=opts['quiet']
                     )
 
@@ -325,33 +651,105 @@ class Dependencies():
                     self.util.print(f'{scr} failed', quiet=opts['quiet'])
         return ret
 
+    def _run_bundle(self, phase, scripts, **kwargs):
+        """
+        Sends the scripts of one phase to the target in one sync and runs them in order
+        through a single remote runner, instead of one copy and one command per script.
+        The runner marks where each script starts and ends and reports its exit code, so
+        output, logs and results stay per script. Each script's stderr is merged into
+        its stdout.
+
+        Args:
+          - phase (str): 'prereqscripts', 'postreqscripts' or 'driverscripts', the
+            Util.local_filepaths/remote_filepaths key of the scripts
+          - scripts (list): Script names to run, in order
+        Keyword args:
+          - quiet (bool): [False] Set to true to hide status messages
+          - strict (bool): [True] Stop at the first failing script and raise
+          - logs (function): [None] Called as logs(script) for the path of a file to write
+            that script's output to
+        Returns:
+            A dict of exit codes by script name, in run order. Scripts that didn't run
+            (after a failure with strict, or if the connection dropped) are left out
+        Raises:
+          - paramiko.ssh_exception.SSHException if strict=True and a script fails
+        """
+        opts = {
+            'quiet'     : False,
+            'strict'    : True,
+            'logs'      : None
+        }
+        opts.update(kwargs)
+        if not scripts:
+            return {}
+
+        rdir = self.util.remote_filepaths[phase]
+        self.util.copy_file(self.util.local_filepaths[phase], rdir, members=scripts,
+                            perm=0o711, sync='mtime', quiet=opts['quiet'])
+
+        marker = uuid.uuid4().hex
+        names = ' '.join(shlex.quote(scr) for scr in scripts)
+        stop = ' || exit "$rc"' if opts['strict'] else ''
+        runner = (f'for scr in {names}; do '
+                  f'printf "%s\\n" "{marker} BEGIN $scr"; '
+                  f'{shlex.quote(rdir)}/"$scr" </dev/null 2>&1; rc=$?; '
+                  f'printf "%s\\n" "{marker} END $scr $rc"; '
+                  f'[ "$rc" -eq 0 ]{stop}; done; true')
+
+        results = {}
+        current = {'log': None}
+
+        def on_line(line, _stamp):
+            idx = line.find(marker)
+            if idx != 0:
+                # script output, possibly with a marker glued to its unterminated last line
+                text = line if idx < 0 else line[:idx]
+                if current['log']:
+                    current['log'].write(f'{text}\n')
+                if not opts['quiet']:
+                    self.util.print(text, use_logger=False)
+            if idx < 0:
+                return
+            kind, _, rest = line[idx + len(marker) + 1:].partition(' ')
+            if kind == 'BEGIN':
+                if not opts['quiet']:
+                    self.util.print(f'Running {rdir}/{rest}')
+                if opts['logs']:
+                    current['log'] = open(opts['logs'](rest), 'w')
+            elif kind == 'END':
+                scr, _, code = rest.rpartition(' ')
+                results[scr] = int(code)
+                if current['log']:
+                    current['log'].close()
+                    current['log'] = None
+
+        try:
+            self.util.run_command(runner, quiet=True, stdout_cb=on_line, echo=False,
+                                  logger=f'dependencies.{phase}')
+        finally:
+            if current['log']:
+                current['log'].close()
+
+        for scr in scripts:
+            if results.get(scr, -1) != 0:
+                self.util.print(f'{scr} failed', quiet=opts['quiet'])
+                if opts['strict']:
+                    raise paramiko.ssh_exception.SSHException(
+                        f"'{rdir}/{scr}' failed with code {results.get(scr, -1)}")
+        return results
+
     def _detect_package_manager(self, cfg):
         """
         Detects the package manager used by the currently connected util library
         and returns the string containing the command. Otherwise raises a ValueError
         because I couldn't think of a better one to spit out
+
+        The answer comes from Util.get_facts, so it is only probed once per boot.
         """
 
         ### ADD SUDO TO LINUX PACKAGE MANAGERS TO REMOVE WINDOWS BUG
-        pkgman = None
-        self.util.connect(cfg)
-
-        # check for choco. This is a required prereq for windows installs
-        if self.util.run_command('choco -v', quiet=True) == 0:
-            pkgman = 'choco'
-        # check for zypper
-        elif self.util.run_command('[ -n "$(which zypper 2>/dev/null)" ]', quiet=True) == 0:
-            pkgman = 'zypper'
-        # check for apt
-        elif self.util.run_command('[ -n "$(which apt-get 2>/dev/null)" ]', quiet=True) == 0:
-            pkgman = 'apt-get'
-        # check for dnf
-        elif self.util.run_command('[ -n "$(which dnf 2>/dev/null)" ]', quiet=True) == 0:
-            pkgman = 'dnf'
-        # check for yum
-        elif self.util.run_command('[ -n "$(which yum 2>/dev/null)" ]', quiet=True) == 0:
-            pkgman = 'yum'
-        else:
+        pkgman = self.util.get_facts(cfg)['pkgman']
+        if pkgman is None:
             raise ValueError('I don\'t know how to install packages on this system.')
 
         return pkgman
@@ -364,7 +762,12 @@ class Dependencies():
           - cfg (dict): The configuration of the target from Util.build_config
         Keyword args:
           - extrapackges (list): [[]] List of extra packages to install
-          - pkgmanager (str): ['yum'] Package manager to use
+          - pkgmanager (str): [None] Package manager to use. Detected if not given
+          - cache (bool): [None] Use the host-side package cache of the OS profile, see
+            Dependencies.prime_package_cache. Defaults to the package_cache field of the
+            OS profile, which is off unless set
+          - cache_port (int): [Dependencies._CACHE_PORT] Port the host serves the package
+            cache on
           - quiet (bool): [False] Set to true to hide status messages
           - strict (bool): [True] Throw an error if a prereq script fails
         Returns:
@@ -374,35 +777,231 @@ class Dependencies():
         """
         opts = {
             'extrapackages' : [],
-            'pkgmanager'    : self._detect_package_manager(cfg),
+            'pkgmanager'    : None,
+            'cache'         : None,
+            'cache_port'    : self._CACHE_PORT,
             'quiet'         : False,
             'strict'        : True
         }
         opts.update(kwargs)
         self.util.connect(cfg)
+        if opts['pkgmanager'] is None:
+            opts['pkgmanager'] = self._detect_package_manager(cfg)
 
         self.util.print("Attempting to install packages...", quiet=opts['quiet'])
 
         # build package list
-        pkglist = opts['extrapackages']
+        pkglist = list(opts['extrapackages'])
         if 'packages' in cfg['os'] and cfg['os']['packages']:
             pkglist.extend(cfg['os']['packages'])
 
+        if opts['cache'] is None:
+            opts['cache'] = cfg['os'].get('package_cache', False)
+
         # install packages
         if pkglist:
+            if opts['cache']:
+                self.prime_package_cache(cfg, pkglist, pkgmanager=opts['pkgmanager'],
+                                         cache_port=opts['cache_port'], quiet=opts['quiet'])
             self.util.print(f'Installing {len(pkglist)} packages...', quiet=opts['quiet'])
             routefix = f'sudo -E pkill {opts["pkgmanager"]} || : '
             cmdstr = f'{routefix} && sudo -E {opts["pkgmanager"]} install -y {" ".join(pkglist)}'
-            if self.util.run_command(
-                    cmdstr,
-                    strict=opts['strict'],
-                    quiet=opts['quiet']
-                ) != 0:
-                pkglist = []
+            try:
+                if self.util.run_command(
+                        cmdstr,
+                        strict=opts['strict'],
+                        quiet=opts['quiet']
+                    ) != 0:
+                    pkglist = []
+            finally:
+                # the host stops serving the cache when it exits, don't leave the
+                # target pointed at it
+                if opts['cache']:
+                    self._remove_package_cache(opts['pkgmanager'])
         else:
             self.util.print('No packages listed for installation.', quiet=opts['quiet'])
         return len(pkglist)
 
+    def prime_package_cache(self, cfg, pkglist, **kwargs):
+        """
+        Points the package manager of the target at the host-side package cache of its OS
+        profile, so packages come from the test host instead of upstream. The cache lives
+        at Util.local_filepaths['packages']/<profile> and the host serves it over HTTP (see
+        Dependencies._serve_package_cache) on the address the target's SSH session comes
+        from, so nothing is copied onto the target.
+
+        For yum and dnf the cache is a repo indexed by createrepo_c (or createrepo) on the
+        host, installed as aslinuxtester-cache.repo with priority=1 and cost=1 so it wins
+        over other repos. For apt-get it is a flat repo indexed by dpkg-scanpackages on the
+        host, installed as aslinuxtester-cache.list and trusted without a signature.
+
+        Packages the cache has no files for are downloaded on this target without being
+        installed, along with their dependencies, into Util.remote_filepaths['packages'],
+        and pulled back into the cache for the next target. The manifest.json of the cache
+        lists the package files in it and the package names they provide.
+
+        The repo stays installed until Dependencies._remove_package_cache, which
+        install_packages calls once it has installed the packages.
+
+        Args:
+          - cfg (dict): The configuration of the target from Util.build_config
+          - pkglist (list): Names of the packages about to be installed
+        Keyword args:
+          - pkgmanager (str): [None] Package manager of the target. Detected if not given
+          - cache_port (int): [Dependencies._CACHE_PORT] Port to serve the cache on, any
+            free one if 0. Open it in the host firewall
+          - quiet (bool): [False] Set to true to hide status messages
+        Returns:
+            True if the target will install from the cache, otherwise False
+        """
+        opts = {
+            'pkgmanager'    : None,
+            'cache_port'    : self._CACHE_PORT,
+            'quiet'         : False
+        }
+        opts.update(kwargs)
+        if opts['pkgmanager'] is None:
+            opts['pkgmanager'] = self._detect_package_manager(cfg)
+        pkgman = opts['pkgmanager']
+        if pkgman not in ('yum', 'dnf', 'apt-get'):
+            self.util.print(f'No package cache for {pkgman}', quiet=opts['quiet'])
+            return False
+
+        profile = cfg['os']['profile']
+        ldir = os.path.join(self.util.local_filepaths['packages'], profile)
+        manifest = os.path.join(ldir, 'manifest.json')
+        try:
+            with open(manifest, 'r') as mfile:
+                cached = set(json.load(mfile)['packages'])
+        except (OSError, ValueError, KeyError):
+            cached = set()
+
+        missing = sorted(set(pkglist) - cached)
+        if missing:
+            self.util.print(f'Adding {len(missing)} packages to the {profile} package '
+                            f'cache...', quiet=opts['quiet'])
+            if not self._download_packages(missing, ldir, pkgman, quiet=opts['quiet']):
+                self.util.print('Could not add the packages to the package cache',
+                                quiet=opts['quiet'])
+            ext = '.deb' if pkgman == 'apt-get' else '.rpm'
+            files = sorted(name for name in os.listdir(ldir) if name.endswith(ext)) \
+                if os.path.isdir(ldir) else []
+            if files:
+                if pkgman == 'apt-get':
+                    index = 'dpkg-scanpackages -m . /dev/null > Packages'
+                else:
+                    index = 'createrepo_c -q . || createrepo -q .'
+                if subprocess.run(['/bin/sh', '-c', index], cwd=ldir, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL).returncode != 0:
+                    self.util.print(f'Could not index the {profile} package cache',
+                                    quiet=opts['quiet'])
+                    return False
+                # name_version_arch.deb, name-version-release.arch.rpm
+                if pkgman == 'apt-get':
+                    cached = {name.split('_', 1)[0] for name in files}
+                else:
+                    cached = {name.rsplit('-', 2)[0] for name in files}
+                with open(f'{manifest}.tmp', 'w') as mfile:
+                    json.dump({'files': files, 'packages': sorted(cached)}, mfile, indent=2)
+                os.replace(f'{manifest}.tmp', manifest)
+        if not cached:
+            return False
+
+        conn = self.util.run_command('echo "$SSH_CONNECTION"', stdout=True, quiet=True).split()
+        if not conn:
+            self.util.print('Cannot tell which address the target reaches the host on',
+                            quiet=opts['quiet'])
+            return False
+        host = f'[{conn[0]}]' if ':' in conn[0] else conn[0]
+        url = (f'http://{host}:{self._serve_package_cache(opts["cache_port"])}/'
+               f'{urllib.parse.quote(profile)}')
+
+        if pkgman == 'apt-get':
+            srclist = self._CACHE_LIST
+            entry = f'deb [trusted=yes] {url}/ ./'
+            return self.util.run_command(
+                f'echo {shlex.quote(entry)} | sudo -E tee {srclist} > /dev/null && '
+                f'sudo -E apt-get update -o Dir::Etc::sourcelist={srclist} '
+                f'-o Dir::Etc::sourceparts=- -o APT::Get::List-Cleanup=0',
+                quiet=opts['quiet']) == 0
+        repo = {
+            'name'          : 'aslinuxtester-cache',
+            'baseurl'       : url,
+            'extraoptions'  : {'gpgcheck': 0, 'priority': 1, 'cost': 1, 'metadata_expire': 0,
+                              'skip_if_unavailable': 1}
+        }
+        return self._install_repo_files({f'{repo["name"]}.repo': self._render_repo(repo)},
+                                        quiet=opts['quiet']) == 1
+
+    def _download_packages(self, pkglist, ldir, pkgman, **kwargs):
+        """
+        Downloads packages and their dependencies on the target without installing them,
+        into Util.remote_filepaths['packages'], then pulls them into ldir and removes
+        them from the target.
+
+        Args:
+          - pkglist (list): Names of the packages to download
+          - ldir (str): Local directory to pull the package files into
+          - pkgman (str): Package manager of the target, one of yum, dnf or apt-get
+        Keyword args:
+          - quiet (bool): [False] Set to true to hide status messages
+        Returns:
+            True if successful, otherwise False
+        """
+        opts = {
+            'quiet' : False
+        }
+        opts.update(kwargs)
+
+        rpath = shlex.quote(self.util.remote_filepaths['packages'])
+        rdir = self.util.run_command(f'rm -rf {rpath} && mkdir -p {rpath} && cd {rpath} && pwd',
+                                     stdout=True, quiet=True).strip()
+        if not rdir:
+            return False
+        rdir = shlex.quote(rdir)
+        pkgs = ' '.join(shlex.quote(pkg) for pkg in pkglist)
+        if pkgman == 'apt-get':
+            cmdstr = (f'mkdir -p {rdir}/partial && sudo -E apt-get install -y --download-only '
+                      f'-o Dir::Cache::archives={rdir} {pkgs} && '
+                      f'sudo -E rm -rf {rdir}/partial {rdir}/lock')
+        else:
+            cmdstr = f'sudo -E {pkgman} install -y --downloadonly --downloaddir={rdir} {pkgs}'
+        cmdstr += f' && sudo -E chown -R "$(id -u):$(id -g)" {rdir}'
+        ret = self.util.run_command(cmdstr, quiet=opts['quiet']) == 0
+        if ret:
+            os.makedirs(ldir, exist_ok=True)
+            ret = self.util.get_file(self.util.remote_filepaths['packages'], ldir, bulk=True,
+                                     quiet=opts['quiet']) > 0
+        self.util.run_command(f'rm -rf {rdir}', quiet=True)
+        return ret
+
+    def _remove_package_cache(self, pkgman):
+        """
+        Removes the repo file of Dependencies.prime_package_cache from the target, if it
+        is there. Returns True if successful
+        """
+        if pkgman == 'apt-get':
+            path = self._CACHE_LIST
+        else:
+            path = f'{self._REPO_DIR}/aslinuxtester-cache.repo'
+        return self.util.run_command(f'sudo -E rm -f {path}', quiet=True) == 0
+
+    def _serve_package_cache(self, port):
+        """
+        Serves Util.local_filepaths['packages'] over HTTP on port on all addresses of the
+        host, any free port if 0, and returns the port. The server is started on the first
+        call and runs in a daemon thread, shared by every Dependencies object in the
+        process that uses the same directory and port.
+        """
+        root = self.util.local_filepaths['packages']
+        with Dependencies._cache_lock:
+            if (root, port) not in Dependencies._cache_servers:
+                handler = functools.partial(_CacheRequestHandler, directory=root)
+                server = http.server.ThreadingHTTPServer(('', port), handler)
+                threading.Thread(target=server.serve_forever, daemon=True).start()
+                Dependencies._cache_servers[root, port] = server
+            return Dependencies._cache_servers[root, port].server_address[1]
+
     def install_postreqs(self, cfg, **kwargs):
         """
         Copies all files in Util.local_filepaths['postreqscripts'] to the target, then
@@ -415,6 +1014,8 @@ class Dependencies():
           - ignore_scripts (list): [[]] List of script names to ignore
           - quiet (bool): [False] Set to true to hide status messages
           - strict (bool): [True] Throw an error if a postreq script fails
+          - bundle (bool): [True] Send all scripts at once and run them through one remote
+            runner (see Dependencies._run_bundle) instead of one copy and run per script
         Returns:
             The number of scripts run
         Raises:
@@ -424,7 +1025,8 @@ class Dependencies():
         opts = {
             'ignore_scripts'    : [],
             'quiet'             : False,
-            'strict'            : True
+            'strict'            : True,
+            'bundle'            : True
         }
         opts.update(kwargs)
         self.util.connect(cfg)
@@ -443,9 +1045,16 @@ class Dependencies():
                 self.util.print(f'Prereqs list set to {cfg["postreqs"]} from config file',
                                 quiet=opts['quiet'])
                 scriptlist = cfg['postreqs']
+            skipped = [scr for scr in scriptlist if scr in opts['ignore_scripts']]
+            for scr in skipped:
+                self.util.print(f'Skipping {scr}', quiet=opts['quiet'])
+            if opts['bundle']:
+                results = self._run_bundle('postreqscripts',
+                                           [scr for scr in scriptlist if scr not in skipped],
+                                           quiet=opts['quiet'], strict=opts['strict'])
+                return sum(1 for code in results.values() if code == 0)
             for scr in scriptlist:
-                if scr in opts['ignore_scripts']:
-                    self.util.print(f'Skipping {scr}', quiet=opts['quiet'])
+                if scr in skipped:
                     continue
                 lscript = f'{self.util.local_filepaths["postreqscripts"]}/{scr}'
                 rscript = f'{self.util.remote_filepaths["postreqscripts"]}/{scr}'
@@ -453,6 +1062,7 @@ class Dependencies():
                     lscript,
                     rscript,
                     perm=0o711,
+                    sync='mtime',
                     quiet=opts['quiet']
                     )
 
@@ -479,6 +1089,8 @@ class Dependencies():
           - ignore_drivers (list): [[]] List of driver install script names to ignore
           - quiet (bool): [False] Set to true to hide status messages
           - strict (bool): [True] Throw an error if a postreq script fails
+          - bundle (bool): [True] Send all scripts at once and run them through one remote
+            runner (see Dependencies._run_bundle) instead of one copy and run per script
         Returns:
             The number of driver install scripts run successfully
         Raises:
@@ -488,7 +1100,8 @@ class Dependencies():
         opts = {
             'ignore_drivers'    : [],
             'quiet'             : False,
-            'strict'            : True
+            'strict'            : True,
+            'bundle'            : True
         }
         opts.update(kwargs)
         self.util.connect(cfg)
@@ -501,6 +1114,7 @@ class Dependencies():
                             quiet=opts['quiet'])
         else:
             self.util.print("Attempting to install drivers...", quiet=opts['quiet'])
+            drivers = []
             for scr in sorted(cfg['drivers']):
                 if not scr in os.listdir(self.util.local_filepaths['driverscripts']):
                     self.util.print((f" Could not find install script at "
@@ -510,12 +1124,23 @@ class Dependencies():
                         raise IOError
                     else:
                         continue
+                drivers.append(scr)
+            if opts['bundle']:
+                if not os.path.isdir(self.util.local_filepaths["logs"]):
+                    os.makedirs(self.util.local_filepaths["logs"])
+                results = self._run_bundle(
+                    'driverscripts', drivers, quiet=opts['quiet'], strict=opts['strict'],
+                    logs=lambda scr: (f'{self.util.local_filepaths["logs"]}/'
+                                      f'{cfg["os"]["profile"]}-{scr}.install.log'))
+                return sum(1 for code in results.values() if code == 0)
+            for scr in drivers:
                 lscript = f'{self.util.local_filepaths["driverscripts"]}/{scr}'
                 rscript = f'{self.util.remote_filepaths["driverscripts"]}/{scr}'
                 self.util.copy_file(
                     lscript,
                     rscript,
                     perm=0o711,
+                    sync='mtime'
                     )
                 if not os.path.isdir(self.util.local_filepaths["logs"]):
                     os.makedirs(self.util.local_filepaths["logs"])
@@ -536,6 +1161,7 @@ def main():
         'override_ip'   : '',
         'tgt_os'        : None,
         'force'         : False,
+        'restart'       : False,
         'quiet'         : False,
         'repos'         : False,
         'prereqs'       : False,
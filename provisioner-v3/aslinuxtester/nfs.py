@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 """Local NFS Kernel Server controller for use by provisioner"""
 import sys
-import time
 import json
 import os
 import random
@@ -10,8 +9,10 @@ import subprocess
 import shutil
 try:
     from .util import Util
+    from .cobbler import CobblerXMLRPC
 except ImportError:
     from util import Util
+    from cobbler import CobblerXMLRPC
 
 class NFS():
     """
@@ -36,16 +37,23 @@ class NFS():
           - util (util.Util): [None] A previously initialized util.Util object
           - repo_dir (str): [None] The path to the configuration repository
           - quiet (bool): [False] Shut it up you
+          - api_url (str): ['http://127.0.0.1:25151'] URL of the cobbler API, polled to
+            tell when cobblerd is up again after a restart
+          - ready_timeout (float): [60] Seconds to wait for cobblerd, see NFS.wait_ready
         Raises:
           - ValueError if neither repo_dir nor util are provided
         """
 
         opts = {
-            'util'      : None,
-            'repo_dir'  : None,
-            'quiet'     : False
+            'util'          : None,
+            'repo_dir'      : None,
+            'quiet'         : False,
+            'api_url'       : 'http://127.0.0.1:25151',
+            'ready_timeout' : 60
         }
         opts.update(kwargs)
+        self.api_url = opts['api_url']
+        self.ready_timeout = opts['ready_timeout']
 
         if opts['util']:
             self.util = opts['util']
@@ -209,6 +217,7 @@ class NFS():
         ], stdout=sbp_stdout).returncode == 0:
             sys.stdout.flush()
             subprocess.run(['/bin/sh', '-c', 'sudo cobbler sync'], stdout=sbp_stdout)
+            self.wait_ready(quiet=opts['quiet'])
             return_val = subprocess.run([
                 'sudo', 'cobbler', 'system', 'report', '--name', config['system_name']
                 ], stdout=sbp_stdout).returncode
@@ -216,6 +225,24 @@ class NFS():
             return_val = 1
         return return_val
 
+    def wait_ready(self, **kwargs):
+        """
+        Waits until cobblerd answers its API at NFS.api_url, polling on an exponential
+        backoff. Use after restarting or syncing cobblerd instead of sleeping.
+
+        Keyword args:
+          - timeout (float): [NFS.ready_timeout] Seconds to give up after
+          - quiet (bool): [False] Suppress status messages
+        Raises:
+          - TimeoutError if cobblerd doesn't answer within timeout
+        """
+        opts = {
+            'timeout'   : self.ready_timeout,
+            'quiet'     : False
+        }
+        opts.update(kwargs)
+        self.util.wait_for(lambda: CobblerXMLRPC.probe(self.api_url), what='cobblerd', **opts)
+
     def remove_profile(self, osconfig, **kwargs):
         """
         Args:
@@ -267,6 +294,7 @@ class NFS():
           - sigs (bool): [False] Skip cobbler signature update
         Raises:
           - IOError if supplied with an invalid filepath for an ISO to import
+          - TimeoutError if cobblerd doesn't come back after its restart
         Returns:
             True if successful, else False
         """
@@ -295,7 +323,7 @@ class NFS():
         subprocess.run([
             '/bin/sh', '-c', f'sudo systemctl restart cobblerd'
         ], stdout=subprocess.DEVNULL)
-        time.sleep(2)
+        self.wait_ready(quiet=opts['quiet'])
 
         try:
 
@@ -338,7 +366,7 @@ class NFS():
             subprocess.run([
                 'sudo', 'service', 'cobblerd', 'restart'
                 ], check=True, stdout=sbp_stdout)
-            time.sleep(2)
+            self.wait_ready(quiet=opts['quiet'])
 
         except Exception as exc:
             self.util.print('That didn\'t work. Failing out...', quiet=opts['quiet'])
@@ -195,10 +195,17 @@ class Test():
         Keyword args:
           - quiet (bool): [False] Set to true to hide status messages
           - path (str): [{test_name}] Copy path within local_filepaths['logs']
-          - compress (bool): [False] Set to true to enable log compression before copying
-          - archive (str): [logs.targ.gz] If compress is set to True, the name of the archive
+          - compress (bool): [False] Set to true to enable log compression. Remote logs are
+            streamed through gzip straight into the archive on the host, nothing is written
+            to the target
+          - bulk (bool): [False] Stream remote logs as one tar archive instead of one
+            SFTP transfer per file. Implied by compress
+          - archive (str): [logs.tar.gz] With compress set, the name of the archive
         Returns:
-            The directory where the logs were copied to
+            The directory where the logs were copied to, or the path of the archive if
+            compress is set
+        Raises:
+          - IOError if the logs could not be fetched
         """
         # find test in list
         for _test in tgt_cfg['test_scripts']:
@@ -209,6 +216,7 @@ class Test():
             'quiet'     : False,
             'path'      : f'{test_name}',
             'compress'  : False,
+            'bulk'      : False,
             'archive'   : 'logs.tar.gz'
         }
         opts.update(kwargs)
@@ -234,27 +242,21 @@ class Test():
                 locpath = locdir
 
             if self.util.get_local_file(rempath, locpath, quiet=opts['quiet']) < 0:
-                self.util.print('Failed to fetch logs! Exiting with error.', level=self.util.logging.ERROR)
-                exit(-1)
+                raise IOError(f'Failed to fetch logs from {rempath}')
             return locpath
         else:
             remdir = f'{self.util.remote_filepaths["tests"]}/{test_data["name"]}/{test_data["logs"]}'
 
             locdir = f'{self.util.local_filepaths["logs"]}/{opts["path"]}'
             if opts['compress']:
-                self.util.run_command(f'cd {remdir} && tar cpvf {opts["archive"]} .',
-                                      strict=True,
-                                      quiet=True
-                                      )
-                rempath = f'{remdir}/{opts["archive"]}'
                 locpath = f'{locdir}/{opts["archive"]}'
             else:
-                rempath = remdir
                 locpath = locdir
-
-            if self.util.get_file(rempath, locpath, quiet=opts['quiet']) < 0:
-                self.util.print('Failed to fetch logs! Exiting with error.', level=self.util.logging.ERROR)
-                exit(-1)
+            if self.util.get_file(remdir, locpath, quiet=opts['quiet'],
+                                  bulk=opts['bulk'] or opts['compress'],
+                                  compress='gz' if opts['compress'] else None,
+                                  archive=opts['compress']) < 0:
+                raise IOError(f'Failed to fetch logs from {remdir}')
             return locpath
 
     def run_post_test_scripts(self, tgt_cfg, **kwargs):
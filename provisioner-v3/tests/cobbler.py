@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""Tests for aslinuxtester.cobbler.Cobbler against a stand-in cobbler XML-RPC API"""
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from socketserver import ThreadingMixIn
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+from aslinuxtester import cobbler
+
+class FakeCobblerd():
+    """Just enough of cobblerd's XML-RPC API for Cobbler, with the signatures of 3.3.3"""
+
+    INTERFACE_FIELDS = {'macaddress': 'mac_address', 'ipaddress': 'ip_address',
+                        'netmask': 'netmask', 'static': 'static', 'dnsname': 'dns_name'}
+
+    def __init__(self):
+        self.items = {'distro': {}, 'profile': {}, 'system': {}}
+        self.tokens = set()
+        self.logins = 0
+        self.syncs = 0
+        self.synced_systems = []
+        self.events = {}
+        self.dhcp_syncs = 0
+        self._edits = {}
+
+    def _check(self, token):
+        if token not in self.tokens:
+            raise ValueError('invalid token')
+
+    def login(self, user, password):
+        if (user, password) != ('cobbler', 'cobbler'):
+            raise ValueError('login failed')
+        self.logins += 1
+        token = f'token{self.logins}'
+        self.tokens.add(token)
+        return token
+
+    def get_item(self, kind, name, flatten=False, resolved=False):
+        return self.items[kind].get(name, '~')
+
+    def get_item_names(self, kind):
+        return sorted(self.items[kind])
+
+    def get_distros(self, page=None, results_per_page=None, token=None):
+        return list(self.items['distro'].values())
+
+    def get_profiles(self, page=None, results_per_page=None, token=None):
+        return list(self.items['profile'].values())
+
+    def get_systems(self, page=None, results_per_page=None, token=None):
+        return list(self.items['system'].values())
+
+    def new_item(self, kind, token, is_subobject=False):
+        self._check(token)
+        handle = f'___NEW___{kind}::{len(self._edits)}'
+        self._edits[handle] = {}
+        return handle
+
+    def get_item_handle(self, kind, name, token=None):
+        self._check(token)
+        self._edits[name] = dict(self.items[kind][name])
+        return name
+
+    def modify_item(self, kind, handle, field, value, token):
+        self._check(token)
+        if field == 'modify_interface':
+            interfaces = self._edits[handle].setdefault('interfaces', {})
+            for key, val in value.items():
+                field, netdev = key.split('-', 1)
+                interfaces.setdefault(netdev, {})[self.INTERFACE_FIELDS[field]] = val
+        else:
+            self._edits[handle][field] = value
+        return True
+
+    def save_item(self, kind, handle, token, editmode='bypass'):
+        self._check(token)
+        item = self._edits.pop(handle)
+        self.items[kind][item['name']] = item
+        return True
+
+    def remove_item(self, kind, name, token, recursive=True):
+        self._check(token)
+        children = [('profile', child) for child, item in self.items['profile'].items()
+                    if kind == 'distro' and item.get('distro') == name]
+        children += [('system', child) for child, item in self.items['system'].items()
+                     if kind == 'profile' and item.get('profile') == name]
+        if children and not recursive:
+            raise ValueError(f'removal of {kind} {name} would orphan its children')
+        for child in children:
+            self.remove_item(*child, token, recursive)
+        return self.items[kind].pop(name, None) is not None
+
+    def ping(self):
+        return True
+
+    def sync(self, token):
+        self._check(token)
+        self.syncs += 1
+        return True
+
+    def background_syncsystems(self, options, token):
+        self._check(token)
+        self.synced_systems.append(options['systems'])
+        event = f'event{len(self.events)}'
+        self.events[event] = [time.time(), 'Syncsystems', 'running', []]
+        return event
+
+    def get_task_status(self, event):
+        # running on the first poll, complete after
+        status = list(self.events[event])
+        self.events[event][2] = 'complete'
+        return status
+
+    def sync_dhcp(self, token):
+        self._check(token)
+        self.dhcp_syncs += 1
+        return True
+
+class KeepAliveHandler(SimpleXMLRPCRequestHandler):
+    """Keeps connections open like cobblerd does"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        """Keeps test output clean"""
+
+class ThreadedXMLRPCServer(ThreadingMixIn, SimpleXMLRPCServer):
+    """Serves each kept-alive connection on its own thread"""
+    daemon_threads = True
+
+class CobblerUnitTest(unittest.TestCase):
+    """Holds tests for Cobbler class"""
+
+    def setUp(self):
+        """unittest analog to __init__"""
+        self.fake = FakeCobblerd()
+        self.server = ThreadedXMLRPCServer(('127.0.0.1', 0), requestHandler=KeepAliveHandler,
+                                           allow_none=True, logRequests=False)
+        self.server.register_instance(self.fake)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.cblr = cobbler.Cobbler(repo_dir=os.environ['PWD'], quiet=True, backend='xmlrpc',
+                                    api_url=self.url)
+
+    def tearDown(self):
+        """Stops the stand-in API"""
+        self.cblr.backend.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_add_system(self):
+        """Adds a system with its interface and syncs once"""
+        self.fake.items['profile']['rocky8'] = {'name': 'rocky8'}
+        env = {
+            'SYSTEM_NAME'   : 'board_1',
+            'PROFILE'       : 'rocky8',
+            'MAC_ADDRESS'   : '00:11:22:33:44:55',
+            'NETDEV'        : 'eth0',
+            'IP_ADDRESS'    : '192.168.75.10',
+            'GATEWAY'       : '192.168.75.1',
+            'KOPTS'         : 'console=ttyS0',
+            'KOPTS_POST'    : 'console=ttyS0',
+            'KSMETASTRING'  : 'dev_username=dev dev_password=pw'
+        }
+        self.assertEqual(self.cblr.add_system_ported_from_script(env, quiet=True), 0)
+        system = self.fake.items['system']['board_1']
+        self.assertEqual(system['profile'], 'rocky8')
+        self.assertEqual(system['hostname'], 'board-1')
+        self.assertEqual(system['interfaces']['eth0']['mac_address'], '00:11:22:33:44:55')
+        self.assertTrue(system['interfaces']['eth0']['static'])
+        self.assertEqual(self.fake.syncs, 1)
+
+    @staticmethod
+    def configs(count):
+        """Returns configs for count systems on the rocky8 profile"""
+        return [{
+            'system_name'   : f'board_{i}',
+            'os'            : {'profile': 'rocky8', 'distro': 'rocky'},
+            'mac_address'   : f'00:11:22:33:44:5{i}',
+            'netdev'        : 'eth0',
+            'ip_address'    : f'192.168.75.1{i}',
+            'gateway'       : '192.168.75.1',
+            'dev_username'  : 'dev',
+            'dev_password'  : 'pw'
+        } for i in range(count)]
+
+    def test_provision_systems(self):
+        """Registers a batch of systems with one targeted sync"""
+        self.fake.items['profile']['rocky8'] = {'name': 'rocky8', 'distro': 'rocky-x86_64',
+                                                'autoinstall': 'rocky8.ks'}
+        results = self.cblr.provision_systems(self.configs(3), quiet=True)
+        self.assertEqual(results, {'board_0': True, 'board_1': True, 'board_2': True})
+        self.assertEqual(sorted(self.fake.items['system']), ['board_0', 'board_1', 'board_2'])
+        self.assertEqual(self.fake.syncs, 0)
+        self.assertEqual(self.fake.synced_systems, [['board_0', 'board_1', 'board_2']])
+        self.assertEqual(self.fake.dhcp_syncs, 1)
+
+    def test_reconcile(self):
+        """Changes only what differs from the configs, and nothing on a repeat run"""
+        self.fake.items['profile']['rocky8'] = {'name': 'rocky8', 'distro': 'rocky-x86_64',
+                                                'autoinstall': 'rocky8.ks'}
+        self.fake.items['profile']['old9'] = {'name': 'old9'}
+        self.fake.items['system']['stale'] = {'name': 'stale', 'profile': 'old9'}
+        self.cblr.util.get_os_config = lambda: {'os': {'rocky': {
+            'global': {}, 'rocky8': {}, 'old9': {}}}}
+        self.cblr.reconcile(self.configs(2), quiet=True)
+        self.assertEqual(self.fake.synced_systems, [['board_0', 'board_1']])
+
+        self.assertEqual(self.cblr.plan(self.configs(2)), [])
+        self.assertEqual(self.cblr.reconcile(self.configs(2), quiet=True),
+                         {'board_0': True, 'board_1': True})
+        self.assertEqual(len(self.fake.synced_systems), 1)
+
+        configs = self.configs(2)
+        configs[1]['ip_address'] = '192.168.75.99'
+        self.assertEqual(self.cblr.reconcile(configs, quiet=True, dry_run=True),
+                         {'board_0': True, 'board_1': False})
+        steps = self.cblr.plan(configs)
+        self.assertEqual([(step['action'], step['name'], step['fields']) for step in steps],
+                         [('edit', 'board_1', {})])
+        self.assertEqual(steps[0]['interface'][1]['ip_address'], '192.168.75.99')
+        self.cblr.reconcile(configs, quiet=True)
+        self.assertEqual(self.fake.items['system']['board_1']['interfaces']['eth0']['ip_address'],
+                         '192.168.75.99')
+        self.assertEqual(self.fake.synced_systems[-1], ['board_1'])
+        self.assertEqual(self.fake.syncs, 0)
+
+        self.assertEqual([(step['action'], step['kind'], step['name'])
+                          for step in self.cblr.plan(configs, prune=True)],
+                         [('remove', 'system', 'stale'), ('remove', 'profile', 'old9')])
+        self.cblr.reconcile(configs, quiet=True, prune=True)
+        self.assertEqual(sorted(self.fake.items['system']), ['board_0', 'board_1'])
+        self.assertEqual(sorted(self.fake.items['profile']), ['rocky8'])
+        self.assertEqual(self.fake.syncs, 1)
+
+    def test_iso_digest(self):
+        """Hashes an ISO once, until it changes, and reads back recorded imports"""
+        with tempfile.TemporaryDirectory() as tmp:
+            self.cblr.util.local_filepaths['isos'] = f'{tmp}/isos.json'
+            iso = f'{tmp}/rocky.iso'
+            with open(iso, 'wb') as ifile:
+                ifile.write(os.urandom(3 << 20))
+            digest = self.cblr.iso_digest(iso, quiet=True)
+            self.assertEqual(len(digest), 64)
+            with open(f'{tmp}/isos.json', 'w') as cfile:
+                cfile.write(f'{{"{iso}": {{"mtime": {os.stat(iso).st_mtime_ns}, '
+                            f'"size": {os.stat(iso).st_size}, "digest": "cached"}}}}')
+            self.assertEqual(self.cblr.iso_digest(iso, quiet=True), 'cached')
+            with open(iso, 'r+b') as ifile:
+                ifile.write(b'changed')
+            self.assertNotIn(self.cblr.iso_digest(iso, quiet=True), ('cached', digest))
+
+        self.assertIsNone(self.cblr.imported_digest('rocky-x86_64'))
+        self.fake.items['distro']['rocky-x86_64'] = {'name': 'rocky-x86_64', 'comment': ''}
+        self.assertEqual(self.cblr.imported_digest('rocky-x86_64'), '')
+        self.cblr.backend.edit('distro', 'rocky-x86_64',
+                               {'comment': f'{self.cblr._ISO_COMMENT}{digest}'})
+        self.assertEqual(self.cblr.imported_digest('rocky-x86_64'), digest)
+
+    def test_create_profiles(self):
+        """Imports distinct ISOs at the same time and profiles of one ISO in turn"""
+        running = []
+        overlaps = []
+
+        def create(config, **kwargs):
+            running.append(config['os']['distro'])
+            overlaps.append(sorted(running))
+            time.sleep(0.2)
+            running.remove(config['os']['distro'])
+            return True
+
+        self.cblr.create_profile_if_missing = create
+        self.cblr.create_profiles([{'os': {'profile': profile, 'distro': distro}}
+                                   for profile, distro in (('rocky8', 'rocky'),
+                                                           ('rocky8-nfs', 'rocky'),
+                                                           ('rhel9', 'rhel'))], quiet=True)
+        self.assertIn(['rhel', 'rocky'], overlaps)
+        self.assertNotIn(['rocky', 'rocky'], overlaps)
+
+    def test_create_profile_iso_changed(self):
+        """Replaces the distro of an ISO that changed only when no other profile uses it"""
+        imports = []
+
+        def run(cmd, *args, **kwargs):
+            if 'cobbler import' in cmd[-1]:
+                imports.append((sorted(self.fake.items['distro']),
+                                sorted(self.fake.items['profile'])))
+                self.fake.items['distro']['rocky-x86_64'] = {'name': 'rocky-x86_64'}
+                self.fake.items['profile']['rocky-x86_64'] = {'name': 'rocky-x86_64',
+                                                              'distro': 'rocky-x86_64'}
+            return subprocess.CompletedProcess(cmd, 0)
+
+        self.fake.items['distro']['rocky-x86_64'] = {
+            'name': 'rocky-x86_64', 'comment': f'{self.cblr._ISO_COMMENT}old'}
+        self.fake.items['profile']['rocky-x86_64'] = {'name': 'rocky-x86_64',
+                                                      'distro': 'rocky-x86_64'}
+        self.fake.items['profile']['rocky8-nfs'] = {'name': 'rocky8-nfs',
+                                                    'distro': 'rocky-x86_64'}
+        self.fake.items['system']['rack2'] = {'name': 'rack2', 'profile': 'rocky8-nfs'}
+        self.cblr.iso_digest = lambda path, **kwargs: 'new'
+        config = {'os': {'profile': 'rocky8', 'distro': 'rocky', 'path': '/isos/rocky.iso',
+                         'kickstart': 'rocky8.ks'}}
+        with mock.patch.object(cobbler.subprocess, 'run', run):
+            # another profile still uses the distro, so nothing is removed or imported
+            self.assertFalse(self.cblr.create_profile_if_missing(config, quiet=True))
+            self.assertEqual(imports, [])
+            self.assertEqual(self.cblr.imported_digest('rocky-x86_64'), 'old')
+            self.assertEqual(sorted(self.fake.items['profile']), ['rocky-x86_64', 'rocky8-nfs'])
+            self.assertEqual(sorted(self.fake.items['system']), ['rack2'])
+
+            del self.fake.items['system']['rack2']
+            del self.fake.items['profile']['rocky8-nfs']
+            self.assertTrue(self.cblr.create_profile_if_missing(config, quiet=True))
+            self.assertEqual(imports, [([], [])])
+            self.assertEqual(self.cblr.imported_digest('rocky-x86_64'), 'new')
+            self.assertEqual(sorted(self.fake.items['profile']), ['rocky8'])
+            self.assertEqual(self.fake.items['profile']['rocky8']['distro'], 'rocky-x86_64')
+
+            # the same ISO again reuses the distro
+            self.fake.items['profile'].clear()
+            self.assertTrue(self.cblr.create_profile_if_missing(config, quiet=True))
+            self.assertEqual(len(imports), 1)
+            self.assertEqual(sorted(self.fake.items['profile']), ['rocky8'])
+
+    def test_remove_profile(self):
+        """Removes a profile and its distro"""
+        self.fake.items['profile']['rocky8'] = {'name': 'rocky8'}
+        self.fake.items['distro']['rocky-x86_64'] = {'name': 'rocky-x86_64'}
+        self.assertTrue(self.cblr.remove_profile({'profile': 'rocky8', 'distro': 'rocky'},
+                                                 quiet=True))
+        self.assertEqual(self.fake.items['profile'], {})
+        self.assertEqual(self.fake.items['distro'], {})
+
+    def test_sync_systems_failed(self):
+        """Runs a full sync when the syncsystems task fails"""
+        self.fake.get_task_status = lambda event: [0, 'Syncsystems', 'failed', []]
+        self.assertTrue(self.cblr.sync(systems=['board_0'], quiet=True))
+        self.assertEqual(self.fake.synced_systems, [['board_0']])
+        self.assertEqual(self.fake.syncs, 1)
+        self.assertEqual(self.fake.dhcp_syncs, 0)
+
+    def test_token_expiry(self):
+        """Logs in again when the token has expired"""
+        self.fake.tokens.clear()
+        self.assertTrue(self.cblr.backend.sync())
+        self.assertEqual(self.fake.logins, 2)
+
+    def test_wait_ready(self):
+        """Waits for cobblerd to answer and gives up when it doesn't"""
+        self.cblr.wait_ready(timeout=1)
+        self.assertTrue(self.cblr.backend.ping())
+        self.server.shutdown()
+        self.server.server_close()
+        with self.assertRaises(TimeoutError):
+            self.cblr.wait_ready(timeout=0.5)
+        self.setUp()
+
+    def test_cli_fallback(self):
+        """Falls back to the CLI backend when the API can't be reached"""
+        self.tearDown()
+        cblr = cobbler.Cobbler(repo_dir=os.environ['PWD'], quiet=True, api_url=self.url)
+        self.assertIsInstance(cblr.backend, cobbler.CobblerCLI)
+        self.setUp()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Tests for aslinuxtester.dependencies.Dependencies"""
+import contextlib
+import io
+import json
+import os
+import re
+import subprocess
+import tempfile
+import unittest
+import urllib.request
+import warnings
+from unittest import mock
+from aslinuxtester import util
+from aslinuxtester import dependencies
+from aslinuxtester.dependencies import Dependencies
+
+def ignore_warnings(test_func):
+    """Decorator to defuse the python warnings system"""
+    def do_test(self, *args, **kwargs):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", ResourceWarning)
+            test_func(self, *args, **kwargs)
+    return do_test
+
+class DependenciesUnitTest(unittest.TestCase):
+    """Holds tests for Dependencies class"""
+
+    @ignore_warnings
+    def setUp(self):
+        """unittest analog to __init__"""
+        self.cfg = {
+            'ip_address'    : '10.100.70.52',
+            'dev_username'  : 'root',
+            'dev_password'  : 'password',
+            'port'      : 22,
+            'os'        : {
+                'profile'   : 'unittest',
+                'packages'  : ['tree']
+            }
+        }
+
+        self.cachedir = tempfile.TemporaryDirectory()
+        self.util = util.Util(repo_dir=os.environ['PWD'], loglevel=util.logging.ERROR)
+        self.util.local_filepaths['packages'] = self.cachedir.name
+        self.util.connect(self.cfg, quiet=True)
+        self.dpnd = Dependencies(util=self.util)
+
+    def tearDown(self):
+        """Removes the package cache of the test"""
+        self.cachedir.cleanup()
+
+    @ignore_warnings
+    def test_package_cache(self):
+        """Installs packages from a primed package cache with upstream repos cut off"""
+        self.util.run_command('sudo -E dnf remove -y tree', quiet=True)
+        self.assertTrue(self.dpnd.prime_package_cache(self.cfg, ['tree'], pkgmanager='dnf',
+                                                      quiet=True))
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.cachedir.name, 'unittest', 'repodata', 'repomd.xml')))
+        self.assertTrue(self.dpnd._remove_package_cache('dnf'))
+
+        self.util.run_command('sudo -E mkdir -p /etc/yum.repos.d.off && '
+                              'sudo -E mv /etc/yum.repos.d/*.repo /etc/yum.repos.d.off/ && '
+                              'sudo -E dnf clean all', quiet=True)
+        try:
+            self.assertEqual(self.dpnd.install_packages(self.cfg, pkgmanager='dnf', cache=True,
+                                                        quiet=True), 1)
+            self.assertEqual(self.util.run_command('rpm -q tree', quiet=True), 0)
+            self.assertNotEqual(self.util.run_command(
+                'test -e /etc/yum.repos.d/aslinuxtester-cache.repo', quiet=True), 0)
+        finally:
+            self.util.run_command('sudo -E mv /etc/yum.repos.d.off/*.repo /etc/yum.repos.d/',
+                                  quiet=True)
+
+class DependenciesOfflineTest(unittest.TestCase):
+    """Holds tests for Dependencies that don't need a target"""
+
+    def setUp(self):
+        """unittest analog to __init__"""
+        self.util = util.Util(repo_dir=os.environ['PWD'], loglevel=util.logging.ERROR)
+        self.dpnd = Dependencies(util=self.util)
+
+    def test_run_bundle(self):
+        """Splits bundle output by script into results, logs and stdout"""
+        seen = {}
+
+        def run_command(runner, **kwargs):
+            seen.update(kwargs)
+            marker = re.search(r'([0-9a-f]{32}) BEGIN', runner).group(1)
+            for line in (f'{marker} BEGIN a.sh', 'hello', 'world', f'{marker} END a.sh 0',
+                         f'{marker} BEGIN b.sh', f'partial{marker} END b.sh 3'):
+                kwargs['stdout_cb'](line, 0)
+            return 0
+
+        self.util.copy_file = lambda *args, **kwargs: 1
+        self.util.run_command = run_command
+        with tempfile.TemporaryDirectory() as tmp:
+            for quiet in (False, True):
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    results = self.dpnd._run_bundle(
+                        'driverscripts', ['a.sh', 'b.sh'], strict=False, quiet=quiet,
+                        logs=lambda scr: os.path.join(tmp, f'{scr}.install.log'))
+                self.assertEqual(results, {'a.sh': 0, 'b.sh': 3})
+                self.assertFalse(seen['echo'])
+                with open(os.path.join(tmp, 'a.sh.install.log')) as log:
+                    self.assertEqual(log.read(), 'hello\nworld\n')
+                with open(os.path.join(tmp, 'b.sh.install.log')) as log:
+                    self.assertEqual(log.read(), 'partial\n')
+                lines = out.getvalue().splitlines()
+                self.assertFalse([line for line in lines if 'BEGIN' in line or 'END' in line])
+                if quiet:
+                    self.assertFalse({'hello', 'world', 'partial'} & set(lines))
+                else:
+                    self.assertEqual([line for line in lines if not line.startswith('Running')],
+                                     ['hello', 'world', 'partial', 'b.sh failed'])
+
+    def test_package_cache(self):
+        """Builds, indexes and serves the package cache, and points the target at it"""
+        files = {'dnf': ['tree-1.8.0-10.el9.x86_64.rpm', 'libfoo-devel-2.1-1.el9.noarch.rpm'],
+                 'apt-get': ['tree_2.1.0-1_amd64.deb', 'libfoo-dev_2.1-1_all.deb']}
+        commands = []
+        downloads = []
+        rendered = {}
+
+        def run_command(cmdstr, **kwargs):
+            commands.append(cmdstr)
+            return '10.0.0.1 40000 10.0.0.2 22' if 'SSH_CONNECTION' in cmdstr else 0
+
+        def index(cmd, cwd, **kwargs):
+            # stands in for createrepo_c and dpkg-scanpackages
+            name = 'Packages' if 'dpkg-scanpackages' in cmd[-1] else 'repodata/repomd.xml'
+            os.makedirs(os.path.dirname(os.path.join(cwd, name)), exist_ok=True)
+            with open(os.path.join(cwd, name), 'w') as ifile:
+                ifile.write(' '.join(sorted(os.listdir(cwd))))
+            return subprocess.CompletedProcess(cmd, 0)
+
+        self.util.run_command = run_command
+        self.util.connect = lambda *args, **kwargs: None
+        self.dpnd._install_repo_files = lambda repos, **kwargs: rendered.update(repos) or 1
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.object(dependencies.subprocess, 'run', index):
+            self.util.local_filepaths['packages'] = tmp
+            for pkgman, names in files.items():
+                cfg = {'os': {'profile': f'unit {pkgman}', 'packages': ['tree', 'libfoo']}}
+                ldir = os.path.join(tmp, cfg['os']['profile'])
+
+                def download(pkglist, path, pkgman, **kwargs):
+                    downloads.append(pkglist)
+                    os.makedirs(path, exist_ok=True)
+                    for name in names:
+                        open(os.path.join(path, name), 'w').close()
+                    # fails part way, what did arrive is still cached
+                    return False
+
+                self.dpnd._download_packages = download
+                downloads.clear()
+                self.assertTrue(self.dpnd.prime_package_cache(
+                    cfg, ['tree', 'libfoo'], pkgmanager=pkgman, cache_port=0, quiet=True))
+                with open(os.path.join(ldir, 'manifest.json')) as mfile:
+                    manifest = json.load(mfile)
+                self.assertEqual(manifest['files'], sorted(names))
+                self.assertEqual(manifest['packages'],
+                                 sorted(name.split('_')[0] if pkgman == 'apt-get'
+                                        else name.rsplit('-', 2)[0] for name in names))
+                self.assertEqual(downloads, [['libfoo', 'tree']])
+
+                port = self.dpnd._serve_package_cache(0)
+                url = f'http://10.0.0.1:{port}/unit%20{pkgman}'
+                if pkgman == 'apt-get':
+                    self.assertIn(f'deb [trusted=yes] {url}/ ./', commands[-1])
+                    index_path = 'Packages'
+                else:
+                    repo = rendered['aslinuxtester-cache.repo']
+                    self.assertIn(f'baseurl={url}\n', repo)
+                    self.assertIn('priority=1\n', repo)
+                    index_path = 'repodata/repomd.xml'
+                with urllib.request.urlopen(
+                        f'http://127.0.0.1:{port}/unit%20{pkgman}/{index_path}') as resp, \
+                        open(os.path.join(ldir, index_path), 'rb') as ifile:
+                    self.assertEqual(resp.read(), ifile.read())
+
+                # libfoo is still not cached by name, tree no longer needs a download
+                self.dpnd.prime_package_cache(cfg, ['tree', 'libfoo'], pkgmanager=pkgman,
+                                              cache_port=0, quiet=True)
+                self.assertEqual(downloads[-1], ['libfoo'])
+
+                commands.clear()
+                self.dpnd.prime_package_cache = lambda *args, **kwargs: True
+                self.assertEqual(self.dpnd.install_packages(cfg, pkgmanager=pkgman, cache=True,
+                                                            quiet=True), 2)
+                del self.dpnd.prime_package_cache
+                self.assertIn(' install -y tree libfoo', commands[-2])
+                self.assertRegex(commands[-1], r'^sudo -E rm -f /etc/.*aslinuxtester-cache')
+
+if __name__ == '__main__':
+    unittest.main()
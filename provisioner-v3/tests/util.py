@@ -2,6 +2,7 @@
 """Tests for aslinuxtester.util.Util"""
 import os
 import subprocess
+import tempfile
 import unittest
 import warnings
 from aslinuxtester import util
@@ -35,6 +36,21 @@ class UtilUnitTest(unittest.TestCase):
         """Tests running a command remotely via Util.run_command"""
         self.assertEqual(self.util.run_command('true', quiet=True), 0)
 
+    @ignore_warnings
+    def test_connection_reuse(self):
+        """Reconnecting to a live target hands back the pooled client"""
+        client = self.util._client
+        self.assertIs(self.util.connect(self.cfg, quiet=True), client)
+        self.assertIsNot(self.util.connect(self.cfg, quiet=True, fresh=True), client)
+        self.assertEqual(self.util.run_command('true', quiet=True), 0)
+
+    @ignore_warnings
+    def test_session_command(self):
+        """Runs commands through the persistent shell session"""
+        self.assertEqual(self.util.run_command('exit 3', quiet=True, session=True), 3)
+        self.assertEqual(self.util.run_command('printf "a\\nb"', quiet=True, session=True,
+                                               stdout=True), 'a\nb')
+
     @ignore_warnings
     def test_copy_and_get_file(self):
         """Creates a dummy file, copies to remote host, then copies back"""
@@ -50,6 +66,77 @@ class UtilUnitTest(unittest.TestCase):
             'this/is/a/dumb/test/but_it_works'
         ]).returncode, 0)
 
+    @ignore_warnings
+    def test_bulk_copy(self):
+        """Streams a directory over as one tar archive and checks contents and modes"""
+        subprocess.run(['/bin/sh', '-c', 'rm -rf bulk && mkdir -p bulk/sub'])
+        subprocess.run(['/bin/sh', '-c', 'echo "success" > bulk/sub/file && chmod 751 bulk/sub/file'])
+        self.util.run_command('rm -rf bulk', quiet=True)
+        self.assertEqual(self.util.copy_file('bulk', 'bulk', bulk=True, compress='gz',
+                                             quiet=True), 1)
+        self.assertEqual(self.util.run_command('cat bulk/sub/file', stdout=True, quiet=True),
+                         'success\n')
+        self.assertEqual(self.util.run_command('stat -c %a bulk/sub/file', stdout=True,
+                                               quiet=True).strip(), '751')
+
+    @ignore_warnings
+    def test_sync_copy(self):
+        """Syncs a directory twice and checks only changed files are sent the second time"""
+        subprocess.run(['/bin/sh', '-c', 'rm -rf sync && mkdir -p sync/sub'])
+        subprocess.run(['/bin/sh', '-c', 'echo one > sync/a && echo two > sync/sub/b'])
+        self.util.run_command('rm -rf sync', quiet=True)
+        self.assertEqual(self.util.copy_file('sync', 'sync', sync='mtime', quiet=True), 2)
+        self.assertEqual(self.util.copy_file('sync', 'sync', sync='mtime', quiet=True), 0)
+        subprocess.run(['/bin/sh', '-c', 'echo three > sync/sub/b'])
+        self.assertEqual(self.util.copy_file('sync', 'sync', sync='hash', quiet=True), 1)
+        self.assertEqual(self.util.run_command('cat sync/sub/b', stdout=True, quiet=True),
+                         'three\n')
+
+    @ignore_warnings
+    def test_bulk_get(self):
+        """Streams a remote directory back as one tar archive"""
+        subprocess.run(['rm', '-rf', '/tmp/bulk2'])
+        self.util.run_command('rm -rf bulk && mkdir -p bulk/sub && echo "success" > bulk/sub/file',
+                              quiet=True)
+        self.assertEqual(self.util.get_file('bulk', '/tmp/bulk2', bulk=True, compress='gz',
+                                            quiet=True), 1)
+        with open('/tmp/bulk2/sub/file') as lfile:
+            self.assertEqual(lfile.read(), 'success\n')
+        self.assertEqual(self.util.get_file('bulk/missing', '/tmp/bulk2/missing', bulk=True,
+                                            quiet=True), -1)
+
+    @ignore_warnings
+    def test_large_file_round_trip(self):
+        """Sends and fetches a file through the ranged transfer engine"""
+        with open('large.bin', 'wb') as lfile:
+            lfile.write(os.urandom(20 << 20))
+        self.util.copy_file('large.bin', 'large.bin', large_file=1 << 20, sessions=3,
+                            quiet=True)
+        self.util.get_file('large.bin', '/tmp/large.bin', large_file=1 << 20, sessions=3,
+                           quiet=True)
+        self.assertEqual(subprocess.run(['cmp', 'large.bin', '/tmp/large.bin']).returncode, 0)
+        self.assertFalse(os.path.exists('/tmp/large.bin.part.json'))
+
+    @ignore_warnings
+    def test_facts_cached(self):
+        """Gathers target facts once and reuses them until the connection changes"""
+        facts = self.util.get_facts(self.cfg)
+        self.assertIsNotNone(facts['pkgman'])
+        self.assertEqual(facts['boot_id'], self.util.get_boot_id())
+        self.assertIs(self.util.get_facts(self.cfg), facts)
+        self.util.connect(self.cfg, fresh=True)
+        self.assertEqual(self.util.get_facts(self.cfg), facts)
+
+    @ignore_warnings
+    def test_remote_json(self):
+        """Writes a JSON file to the target and reads it back"""
+        self.util.connect(self.cfg, quiet=True)
+        data = {'repos': 'abc', 'drivers': None}
+        self.util.write_remote_json('test_remote.json', data)
+        self.assertEqual(self.util.read_remote_json('test_remote.json'), data)
+        self.util.run_command('rm -f test_remote.json', quiet=True)
+        self.assertIsNone(self.util.read_remote_json('test_remote.json'))
+
     @ignore_warnings
     def test_reboot_and_reconnect(self):
         """Rebots the remote host, then attempts to reconnect"""
@@ -61,5 +148,77 @@ class UtilUnitTest(unittest.TestCase):
         except util.paramiko.ssh_exception.SSHException:
             raise AssertionError("Could not reconnect to the target")
 
+    @ignore_warnings
+    def test_reboot_reports_timings(self):
+        """Reboots through Util.reboot and checks the target came back on a new boot"""
+        res = self.util.reboot(self.cfg, iboot=False, connectargs={'quiet': True})
+        self.assertIsNotNone(res['down'])
+        self.assertGreater(res['up'], res['down'])
+        self.assertNotEqual(res['boot_id'], res['old_boot_id'])
+        self.assertEqual(self.util.run_command('true', quiet=True), 0)
+
+class UtilOfflineTest(unittest.TestCase):
+    """Holds tests for the parts of util that don't need a target"""
+
+    def setUp(self):
+        """unittest analog to __init__"""
+        self.util = util.Util(repo_dir=os.environ['PWD'], loglevel=util.logging.ERROR)
+
+    def test_task_graph(self):
+        """Runs independent tasks together and traces the critical path"""
+        graph = util.TaskGraph(workers=2)
+        graph.add('a', lambda: util.time.sleep(0.2) or 'a')
+        graph.add('b', lambda: util.time.sleep(0.4) or 'b')
+        graph.add('c', lambda: 'c', after=['a', 'b'])
+        start = util.time.time()
+        self.assertEqual(graph.run(), {'a': 'a', 'b': 'b', 'c': 'c'})
+        self.assertLess(util.time.time() - start, 0.6)
+        self.assertEqual([name for name, _start, _end in graph.critical_path()], ['b', 'c'])
+
+    def test_wait_for(self):
+        """Polls until a check passes, and gives up at the timeout"""
+        ready = util.time.monotonic() + 0.3
+        self.assertTrue(self.util.wait_for(lambda: util.time.monotonic() > ready,
+                                           timeout=5, quiet=True))
+        with self.assertRaises(TimeoutError):
+            self.util.wait_for(lambda: False, timeout=0.3, quiet=True)
+
+    def test_line_reader(self):
+        """Decodes lines across chunk boundaries and flushes the last one on close"""
+        lines = []
+        reader = util.LineReader(callback=lines.append)
+        data = 'één\r\ntwo\nthree'.encode()
+        # split inside the first é, between \r and \n, and inside the unterminated line
+        for chunk in (data[:1], data[1:6], data[6:7], data[7:13], data[13:]):
+            reader.feed(chunk)
+        self.assertEqual(lines, ['één', 'two'])
+        reader.close()
+        self.assertEqual(lines, ['één', 'two', 'three'])
+        self.assertEqual(reader.getvalue(), 'één\r\ntwo\nthree')
+
+    def test_output_capture(self):
+        """Keeps the last KiB in memory and spills everything to disk"""
+        cap = util.OutputCapture(limit=1)
+        for i in range(10):
+            cap.write(bytes([ord('a') + i]) * 300)
+        self.assertEqual(cap.size, 3000)
+        self.assertEqual(cap.tail(), 'g' * 124 + 'h' * 300 + 'i' * 300 + 'j' * 300)
+        self.assertEqual(cap.getvalue(), cap.tail())
+        cap.close()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cap = util.OutputCapture(limit=1, spill=f'{tmp}/out')
+            data = os.urandom(4096).hex().encode()
+            for start in range(0, len(data), 1000):
+                cap.write(data[start:start + 1000])
+            self.assertEqual(cap.tail(), data[-1024:].decode())
+            self.assertEqual(cap.getvalue(), data.decode())
+            view = cap.mmap()
+            self.assertEqual(view[:], data)
+            view.close()
+            cap.close()
+            with open(f'{tmp}/out', 'rb') as sfile:
+                self.assertEqual(sfile.read(), data)
+
 if __name__ == "__main__":
     unittest.main()